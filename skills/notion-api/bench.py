@@ -0,0 +1,425 @@
+#!/usr/bin/env python3
+"""Benchmarks for the markdown parser and upload path of upload.py.
+
+Generates a synthetic corpus (heading-heavy outlines, giant code fences,
+wide and long tables, a link-dense handbook), then per document measures
+parse throughput, block building (rich text, code splitting), a complete
+upload through an in-process fake_server.LocalPool, the number of requests
+that upload needs and peak memory. Every upload is also interrupted once and
+finished with --resume, which must produce the same page (check_resume).
+Results are compared with a stored baseline; any metric that got worse by
+more than the threshold is reported and the exit status is 1.
+
+Usage:
+    uv run bench.py                 # run, compare with the baseline if there is one
+    uv run bench.py --save          # run and store the results as the new baseline
+    uv run bench.py --only tables-long,code --repeat 5
+    uv run bench.py --corpus DIR    # write the generated markdown files and exit
+
+Flags:
+    --baseline FILE Baseline JSON (default .claude/cache/notion/bench.json).
+    --threshold F   Allowed relative regression for throughput and memory
+                    (default 0.2 = 20%). Request counts are deterministic:
+                    any increase is a regression.
+    --size N        Corpus scale factor (default 1). Baselines only compare
+                    at the same size.
+    --repeat N      Timed runs per measurement, at least (more until 0.5s
+                    have passed); the best one counts (default 3).
+    --only A,B      Run only these documents.
+    --save          Write the results to the baseline file.
+    --corpus DIR    Write the generated documents as DIR/<name>.md instead.
+"""
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import upload
+from fake_server import LocalPool
+
+# ── Corpus ─────────────────────────────────────────────────────────
+
+WORDS = ("request block page table heading upload notion limit token batch parser "
+         "section cursor child mention inline toggle latency budget journal sync "
+         "export stream worker cache schema row column entry handbook policy").split()
+
+
+def _words(rng, n):
+    return " ".join(rng.choice(WORDS) for _ in range(n))
+
+
+def _inline(rng, n):
+    """A sentence with some bold, italic and code spans."""
+    parts = []
+    for _ in range(n):
+        word = rng.choice(WORDS)
+        roll = rng.random()
+        parts.append(f"**{word}**" if roll < 0.08 else f"*{word}*" if roll < 0.14
+                     else f"`{word}()`" if roll < 0.2 else word)
+    return " ".join(parts)
+
+
+def headings_doc(rng, size):
+    """Deep outline: many short H1–H4 sections with a few lines each."""
+    out = ["# Heading-heavy outline", ""]
+    for s in range(100 * size):
+        out.append(f"# Part {s}")
+        for h2 in range(rng.randint(1, 3)):
+            out.append(f"## {_words(rng, 4)} {s}.{h2}")
+            for h3 in range(rng.randint(1, 3)):
+                out.append(f"### {_words(rng, 3)} {s}.{h2}.{h3}")
+                if rng.random() < 0.3:
+                    out.append(f"#### {_words(rng, 3)}")
+                kind = rng.random()
+                if kind < 0.4:
+                    out += [_inline(rng, 14), ""]
+                elif kind < 0.7:
+                    out += [f"- {_inline(rng, 6)}", f"  - {_words(rng, 5)}",
+                            f"- {_words(rng, 6)}", ""]
+                elif kind < 0.85:
+                    out += [f"- [ ] {_words(rng, 5)}", f"- [x] {_words(rng, 5)}", ""]
+                else:
+                    out += [f"1. {_words(rng, 6)}", f"2. {_words(rng, 6)}",
+                            f"> {_inline(rng, 10)}", ""]
+    return "\n".join(out) + "\n", None
+
+
+def code_doc(rng, size):
+    """A few giant fences (split into many code blocks) with quotes and escapes."""
+    out = ["# Code listings", ""]
+    for f in range(4):
+        out += [f"## Listing {f}", "", "```python"]
+        for n in range(4000 * size):
+            indent = "    " * rng.randint(0, 3)
+            roll = rng.random()
+            if roll < 0.1:
+                out.append(f'{indent}log("{_words(rng, 4)}\\t{n}", sep="\\\\")')
+            elif roll < 0.12:
+                out.append(f"{indent}# {_words(rng, 60)}")  # long comment line
+            else:
+                out.append(f"{indent}{rng.choice(WORDS)}_{n} = "
+                           f"{rng.choice(WORDS)}({n}, '{rng.choice(WORDS)}')")
+        out += ["```", ""]
+    return "\n".join(out) + "\n", None
+
+
+def _table(rng, rows, cols, cell_words):
+    out = ["| " + " | ".join(f"col {c}" for c in range(cols)) + " |",
+           "|" + "---|" * cols]
+    for r in range(rows):
+        cells = [_inline(rng, rng.randint(1, cell_words)) for _ in range(cols)]
+        out.append("| " + " | ".join(cells) + " |")
+    return out
+
+
+def tables_wide_doc(rng, size):
+    """Tables with many columns and wordy cells."""
+    out = ["# Wide tables", ""]
+    for t in range(3 * size):
+        out += [f"## Matrix {t}", ""] + _table(rng, 60, 24, 8) + [""]
+    return "\n".join(out) + "\n", None
+
+
+def tables_long_doc(rng, size):
+    """One table of thousands of rows (created, then appended in row batches)."""
+    out = ["# Long table", "", "## Inventory", ""] + _table(rng, 2500 * size, 5, 3)
+    return "\n".join(out) + "\n", None
+
+
+def handbook_doc(rng, size):
+    """Link-dense prose: most lines link to other pages of a mapped handbook."""
+    pages = [f"team/page-{i}.md" for i in range(200)]
+    link_map = {p: f"{i:08x}-0000-4000-8000-{i:012x}" for i, p in enumerate(pages)}
+    out = ["# Handbook", ""]
+    for s in range(200 * size):
+        out += [f"## {_words(rng, 3)} {s}", ""]
+        for _ in range(rng.randint(2, 5)):
+            links = []
+            for _ in range(rng.randint(2, 6)):
+                roll = rng.random()
+                if roll < 0.6:
+                    links.append(f"[{_words(rng, 2)}](../team/{rng.choice(pages)[5:]})")
+                elif roll < 0.8:
+                    links.append(f"[{_words(rng, 2)}]({rng.choice(pages)}#{rng.choice(WORDS)})")
+                else:
+                    links.append(f"[{_words(rng, 2)}](https://example.com/{rng.choice(WORDS)})")
+            out += [f"{_inline(rng, 8)} " + ", ".join(links) + f" {_words(rng, 6)}.", ""]
+        out += [f"- see [{_words(rng, 2)}]({rng.choice(pages)})" for _ in range(3)] + [""]
+    return "\n".join(out) + "\n", upload.LinkResolver(link_map, "docs")
+
+
+CORPUS = {
+    "headings": headings_doc,
+    "code": code_doc,
+    "tables-wide": tables_wide_doc,
+    "tables-long": tables_long_doc,
+    "handbook": handbook_doc,
+}
+
+
+def generate(name, size, seed=1):
+    """(markdown text, link_map) of one corpus document; deterministic per seed."""
+    return CORPUS[name](random.Random(f"{name}:{seed}"), size)
+
+
+# ── Measurement ────────────────────────────────────────────────────
+
+MIN_TIME = 0.5  # seconds of timed runs per measurement, at least
+PAGE_ID = "be5c0000-0000-4000-8000-000000000000"
+
+# name -> True if higher is better
+METRICS = {
+    "parse_lines_per_s": True,
+    "parse_blocks_per_s": True,
+    "build_blocks_per_s": True,
+    "upload_blocks_per_s": True,
+    "requests": False,
+    "peak_kb": False,
+}
+
+
+def _walk(nodes):
+    stack = list(nodes)
+    while stack:
+        node = stack.pop()
+        if node.type:
+            yield node
+            stack.extend(node.children)
+
+
+def _parse(lines, link_map):
+    upload._cached_rich_text.cache_clear()
+    return upload.parse_markdown(lines, link_map)
+
+
+def _upload(nodes):
+    """Upload nodes to a fresh in-process store; returns (store, request count)."""
+    pool = LocalPool()
+    upload.BASE = pool.base_url
+    upload.POOL = pool
+    upload.METRICS = upload.Metrics()
+    with contextlib.redirect_stdout(io.StringIO()):
+        upload.upload_nodes(PAGE_ID, nodes)
+    return pool.store, upload.METRICS.snapshot()["requests"]
+
+
+def _tree(store, parent):
+    """Content of the blocks below parent in a store, for comparing uploads."""
+    return [(upload.block_key(store.blocks[bid]), _tree(store, bid))
+            for bid in store.children.get(parent, [])]
+
+
+def check_resume(name, nodes, expected):
+    """Interrupt an upload and check that --resume completes the page.
+
+    It is stopped at its second request and at the first one continuing a
+    parent created with children inline (the row batches of a long table),
+    once before and once after that request reached the store.
+    """
+    ops = upload.compile_plan(PAGE_ID, nodes)
+
+    def continues_parent(op):
+        ref = op["parent"]
+        if not isinstance(ref, dict) or "prev" in op:
+            return False
+        block = ops[ref["op"]]["children"][ref["index"]]
+        return bool(block[block["type"]].get("children"))
+
+    stops = {min(1, len(ops) - 1), next((k for k, op in enumerate(ops) if continues_parent(op)), 0)}
+    for stop in sorted(stops):
+        for applied in (False, True):
+            pool = LocalPool()
+            upload.BASE = pool.base_url
+            upload.POOL = pool
+            dispatch = pool.store.dispatch
+
+            def interrupt(method, path, body):
+                if method == "PATCH" and body and body.get("children") == ops[stop]["children"]:
+                    if applied:
+                        dispatch(method, path, body)
+                    raise KeyboardInterrupt
+                return dispatch(method, path, body)
+
+            pool.store.dispatch = interrupt
+            with contextlib.redirect_stdout(io.StringIO()):
+                try:
+                    upload.publish_nodes(PAGE_ID, nodes, force=True)
+                except KeyboardInterrupt:
+                    pool.store.dispatch = dispatch
+                    upload.resume_upload(PAGE_ID)
+            if _tree(pool.store, PAGE_ID) != expected:
+                when = "after" if applied else "before"
+                raise RuntimeError(f"{name}: upload resumed from request {stop + 1} "
+                                   f"({when} it reached Notion) differs")
+
+
+def _best(repeat, run, setup=None):
+    """Fastest of at least `repeat` calls of run(), repeated until MIN_TIME has
+    passed; returns (seconds, last result). GC is off while timing, as in timeit.
+    With `setup`, each call is run(setup()) and only run is timed."""
+    best, total, runs = float("inf"), 0.0, 0
+    gc.collect()
+    gc.disable()
+    try:
+        while runs < repeat or total < MIN_TIME:
+            arg = setup() if setup else None
+            start = time.perf_counter()
+            result = run(arg) if setup else run()
+            seconds = time.perf_counter() - start
+            best, total, runs = min(best, seconds), total + seconds, runs + 1
+    finally:
+        gc.enable()
+    return best, result
+
+
+def measure(name, size, repeat):
+    text, link_map = generate(name, size)
+    lines = text.splitlines(keepends=True)
+
+    parse_s, nodes = _best(repeat, lambda: _parse(lines, link_map))
+    blocks = sum(1 for _ in _walk(nodes))
+
+    def build():
+        upload._cached_rich_text.cache_clear()
+        for node in _walk(nodes):
+            node.block
+    build_s, _ = _best(repeat, build)
+
+    # Each upload gets a freshly parsed tree (and cold rich-text cache), parsed untimed
+    upload_s, (store, requests) = _best(repeat, _upload, setup=lambda: _parse(lines, link_map))
+    if len(store.blocks) != blocks:
+        raise RuntimeError(f"{name}: uploaded {len(store.blocks)} blocks, parsed {blocks}")
+    check_resume(name, _parse(lines, link_map), _tree(store, PAGE_ID))
+
+    # Peak memory of one parse + upload, measured separately: tracing slows everything down
+    tracemalloc.start()
+    _upload(_parse(lines, link_map))
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "lines": len(lines), "blocks": blocks,
+        "parse_lines_per_s": len(lines) / parse_s,
+        "parse_blocks_per_s": blocks / parse_s,
+        "build_blocks_per_s": blocks / build_s,
+        "upload_blocks_per_s": blocks / max(upload_s, 1e-9),
+        "requests": requests,
+        "peak_kb": peak / 1024,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Regressions of results against baseline as printable lines."""
+    regressions = []
+    for name, metrics in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = base.get(metric), metrics[metric]
+            if not old:
+                continue
+            change = (new - old) / old
+            allowed = 0 if metric == "requests" else threshold
+            worse = -change if higher_is_better else change
+            if worse > allowed:
+                regressions.append(f"  {name}: {metric} {old:,.0f} → {new:,.0f} ({change:+.0%})")
+    return regressions
+
+
+def _report(results, baseline):
+    print(f"{'document':<13}{'lines':>8}{'blocks':>8}{'parse l/s':>12}{'parse b/s':>12}"
+          f"{'build b/s':>12}{'upload b/s':>12}{'requests':>10}{'peak KB':>10}")
+    for name, m in results.items():
+        print(f"{name:<13}{m['lines']:>8,}{m['blocks']:>8,}{m['parse_lines_per_s']:>12,.0f}"
+              f"{m['parse_blocks_per_s']:>12,.0f}{m['build_blocks_per_s']:>12,.0f}"
+              f"{m['upload_blocks_per_s']:>12,.0f}{m['requests']:>10,}{m['peak_kb']:>10,.0f}")
+        base = baseline.get(name)
+        if base:
+            print(f"{'  vs baseline':<29}" + "".join(
+                f"{(m[k] - base[k]) / base[k]:>+12.0%}" if base.get(k) else f"{'':>12}"
+                for k in ("parse_lines_per_s", "parse_blocks_per_s", "build_blocks_per_s",
+                          "upload_blocks_per_s"))
+                + "".join(f"{(m[k] - base[k]) / base[k]:>+10.0%}" if base.get(k) else f"{'':>10}"
+                          for k in ("requests", "peak_kb")))
+
+
+# ── Main ───────────────────────────────────────────────────────────
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    baseline_path = upload._pop_option(args, "--baseline",
+                                       os.path.join(upload.JOURNAL_DIR, "bench.json"))
+    threshold = float(upload._pop_option(args, "--threshold", 0.2))
+    size = int(upload._pop_option(args, "--size", 1))
+    repeat = int(upload._pop_option(args, "--repeat", 3))
+    only = upload._pop_option(args, "--only")
+    corpus_dir = upload._pop_option(args, "--corpus")
+    save = upload._pop_flag(args, "--save")
+    if args:
+        sys.exit(__doc__)
+
+    names = only.split(",") if only else list(CORPUS)
+    unknown = [n for n in names if n not in CORPUS]
+    if unknown:
+        sys.exit(f"Unknown documents: {', '.join(unknown)} (available: {', '.join(CORPUS)})")
+
+    if corpus_dir:
+        os.makedirs(corpus_dir, exist_ok=True)
+        for name in names:
+            path = os.path.join(corpus_dir, f"{name}.md")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(generate(name, size)[0])
+            print(f"Wrote {path}")
+        sys.exit(0)
+
+    # In-process transport and no rate limit: the numbers are the uploader's own cost
+    upload.CONFIG, upload.HEADERS = {}, {}
+    upload.LIMITER = upload.RateLimiter(rate=1e9)
+    # Journals and caches of the benchmark's uploads stay out of the user's .claude/cache
+    scratch = tempfile.mkdtemp(prefix="notion-bench-")
+    upload.JOURNAL_DIR = scratch
+    upload.PUBLISHED = upload.PublishCache(os.path.join(scratch, "published.json"))
+    upload.UPLOADS = upload.FileUploadCache(os.path.join(scratch, "uploads.json"))
+
+    stored = {}
+    if os.path.exists(baseline_path):
+        with open(baseline_path, encoding="utf-8") as f:
+            stored = json.load(f)
+    baseline = stored.get("documents", {}) if stored.get("size") == size else {}
+    if stored and not baseline:
+        print(f"Baseline {baseline_path} is for --size {stored.get('size')}; not comparing")
+
+    results = {}
+    try:
+        for name in names:
+            results[name] = measure(name, size, repeat)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+    _report(results, baseline)
+
+    if save:
+        documents = dict(baseline, **results)
+        os.makedirs(os.path.dirname(baseline_path) or ".", exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump({"size": size, "python": platform.python_version(),
+                       "saved": time.strftime("%Y-%m-%dT%H:%M:%S"), "documents": documents},
+                      f, indent=2)
+        print(f"\nSaved baseline to {baseline_path}")
+    elif baseline:
+        regressions = compare(results, baseline, threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {threshold:.0%}:")
+            print("\n".join(regressions))
+            sys.exit(1)
+        print(f"\nNo regressions beyond {threshold:.0%} against {baseline_path}")
+    elif not stored:
+        print(f"\nNo baseline at {baseline_path}; run with --save to create one")
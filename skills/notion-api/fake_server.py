@@ -0,0 +1,812 @@
+#!/usr/bin/env python3
+"""Local stand-in for the Notion block endpoints used by upload.py.
+
+Keeps an in-memory block tree and answers append children, list children
+(with cursors), retrieve/update/delete block, create/retrieve/update page,
+retrieve/query data source and the file upload endpoints (create, send,
+complete, retrieve) like the real API, including its request limits, so
+uploads and imports can be measured offline and reproducibly.
+
+Usage:
+    uv run fake_server.py [--port 8765] [--latency 0.1] [--jitter 0.05]
+                          [--rps 3] [--burst 10] [--inject-429 0.02] [--seed 1]
+                          [--data-sources schemas.json]
+
+Point upload.py at it with NOTION_BASE_URL (or "base_url" in the config):
+    NOTION_BASE_URL=http://127.0.0.1:8765/v1 uv run upload.py <file.md> <any-page-id>
+
+Any unknown ID used as a parent is treated as an empty page. GET /__stats
+returns request counts; POST /__reset clears blocks and counts. From Python,
+LocalPool serves the same store in-process (see bench.py).
+
+Flags:
+    --latency S     Delay added to every response (seconds).
+    --jitter S      Extra random delay, uniform in [0, S].
+    --rps N         Token-bucket limit; excess requests get 429 + Retry-After.
+    --burst N       Bucket size for --rps (default 10).
+    --inject-429 P  Additionally answer a fraction P of requests with 429.
+    --retry-after S Retry-After sent with 429s, in seconds; fractions such as
+                    0.2 are allowed (default 1).
+    --seed N        Seed for jitter and injected 429s.
+    --data-sources FILE
+                    JSON {data source id: {property name: type}} to serve
+                    (one property of type "title" each).
+"""
+import json
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Request limits (https://developers.notion.com/reference/request-limits)
+MAX_CHILDREN = 100
+MAX_NESTING = 2
+MAX_REQUEST_BLOCKS = 1000
+MAX_PAYLOAD_BYTES = 500_000
+MAX_TEXT = 2000
+MAX_RICH_TEXT = 100
+MAX_FILE_PART = 20 * 1024 * 1024  # single-part files and each part of a multi-part upload
+MIN_FILE_PART = 5 * 1024 * 1024   # every part but the last
+UPLOAD_EXPIRY = 3600              # seconds an upload can wait to be attached
+
+ANNOTATIONS = {"bold": False, "italic": False, "strikethrough": False,
+               "underline": False, "code": False, "color": "default"}
+
+
+class NotionError(Exception):
+    def __init__(self, status, code, message):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+
+
+def _now(offset=0):
+    return (datetime.now(timezone.utc) + timedelta(seconds=offset)).strftime("%Y-%m-%dT%H:%M:%S.000Z")
+
+
+def parse_form(raw, content_type):
+    """Fields of a multipart/form-data body: {name: text or (filename, bytes, content type)}."""
+    m = re.search(r'boundary="?([^";]+)"?', content_type)
+    if m is None:
+        raise NotionError(400, "validation_error", "multipart body without a boundary.")
+    fields = {}
+    for part in raw.split(b"--" + m.group(1).encode())[1:-1]:
+        head, _, content = part[2:-2].partition(b"\r\n\r\n")
+        headers = dict(line.split(": ", 1) for line in head.decode().split("\r\n"))
+        disposition = dict(re.findall(r'(\w+)="([^"]*)"', headers.get("Content-Disposition", "")))
+        if "filename" in disposition:
+            fields[disposition["name"]] = (disposition["filename"], content,
+                                           headers.get("Content-Type", "application/octet-stream"))
+        else:
+            fields[disposition["name"]] = content.decode()
+    return fields
+
+
+# ── Block Store ────────────────────────────────────────────────────
+
+class BlockStore:
+    """In-memory block tree with Notion-shaped requests and responses."""
+
+    def __init__(self):
+        self.blocks = {}    # id -> stored block (children excluded)
+        self.children = {}  # id -> [child ids]; unknown ids are pages
+        self.pages = {}     # page id -> {"title": ..., "last_edited_time": ..., "properties": ...}
+        self.data_sources = {}  # data source id -> {"properties": schema, "pages": [page ids]}
+        self.uploads = {}   # file upload id -> file upload object (+ "_parts", "_expires", "_attached")
+        self.lock = threading.Lock()
+
+    # Validation mirrors the documented limits and error codes
+    def _check_rich_text(self, rich_text, where):
+        if len(rich_text) > MAX_RICH_TEXT:
+            raise NotionError(400, "validation_error",
+                              f"body failed validation: {where}.length should be ≤ `{MAX_RICH_TEXT}`, "
+                              f"instead was `{len(rich_text)}`.")
+        for i, seg in enumerate(rich_text):
+            content = seg.get("text", {}).get("content", "")
+            length = len(json.dumps(content)) - 2
+            if length > MAX_TEXT:
+                raise NotionError(400, "validation_error",
+                                  f"body failed validation: {where}[{i}].text.content.length "
+                                  f"should be ≤ `{MAX_TEXT}`, instead was `{length}`.")
+
+    def _check_blocks(self, blocks, where="body.children", level=1):
+        if len(blocks) > MAX_CHILDREN:
+            raise NotionError(400, "validation_error",
+                              f"body failed validation: {where}.length should be ≤ `{MAX_CHILDREN}`, "
+                              f"instead was `{len(blocks)}`.")
+        count = 0
+        for i, block in enumerate(blocks):
+            btype = block.get("type")
+            data = block.get(btype)
+            if not isinstance(data, dict):
+                raise NotionError(400, "validation_error",
+                                  f"body failed validation: {where}[{i}].{btype} should be defined.")
+            path = f"{where}[{i}].{btype}"
+            if "rich_text" in data:
+                self._check_rich_text(data["rich_text"], path + ".rich_text")
+            if data.get("type") == "file_upload":
+                upload_id = data.get("file_upload", {}).get("id")
+                if self._upload_status(upload_id) != "uploaded":
+                    raise NotionError(400, "validation_error",
+                                      f"body failed validation: {path}.file_upload: file upload "
+                                      f"{upload_id} is not uploaded or has expired.")
+            for j, cell in enumerate(data.get("cells", [])):
+                self._check_rich_text(cell, f"{path}.cells[{j}]")
+            kids = data.get("children") or []
+            if kids and level >= MAX_NESTING + 1:
+                raise NotionError(400, "validation_error",
+                                  f"body failed validation: {path}.children should be not present.")
+            if btype == "table" and not kids:
+                raise NotionError(400, "validation_error",
+                                  f"body failed validation: {path}.children should be defined.")
+            count += 1 + self._check_blocks(kids, path + ".children", level + 1)
+        return count
+
+    def _store(self, parent, block):
+        """Create a block (and its inline children); returns its ID."""
+        bid = str(uuid.uuid4())
+        btype = block["type"]
+        data = {k: v for k, v in block[btype].items() if k != "children"}
+        if "rich_text" in data:
+            data["rich_text"] = [self._segment(s) for s in data["rich_text"]]
+        if data.get("type") in ("file_upload", "external"):
+            data["caption"] = [self._segment(s) for s in data.get("caption", [])]
+        if data.get("type") == "file_upload":
+            # Attached uploads become Notion-hosted files and no longer expire
+            upload = self.uploads[data.pop("file_upload")["id"]]
+            upload["_attached"] = True
+            data["type"] = "file"
+            data["file"] = {"url": f"https://files.fake-notion.invalid/{upload['id']}/{upload['filename']}"
+                                   f"?X-Amz-Expires=3600", "expiry_time": _now(3600)}
+        if "cells" in data:
+            data["cells"] = [[self._segment(s) for s in cell] for cell in data["cells"]]
+        now = _now()
+        self.blocks[bid] = {
+            "object": "block", "id": bid, "parent": parent, "type": btype, btype: data,
+            "created_time": now, "last_edited_time": now, "archived": False, "in_trash": False,
+        }
+        self.children[bid] = [self._store({"type": "block_id", "block_id": bid}, kid) for kid in block[btype].get("children") or []]
+        return bid
+
+    @staticmethod
+    def _segment(seg):
+        seg = json.loads(json.dumps(seg))
+        seg["annotations"] = {**ANNOTATIONS, **seg.get("annotations", {})}
+        if seg.get("type") == "mention":
+            page = seg["mention"].get("page", {})
+            seg["plain_text"] = "Untitled"
+            seg["href"] = f"https://www.notion.so/{page.get('id', '').replace('-', '')}"
+        else:
+            seg.setdefault("type", "text")
+            seg["text"].setdefault("link", None)
+            seg["plain_text"] = seg["text"]["content"]
+            seg["href"] = (seg["text"]["link"] or {}).get("url")
+        return seg
+
+    def _view(self, bid):
+        block = dict(self.blocks[bid])
+        block["has_children"] = bool(self.children.get(bid))
+        return block
+
+    def _parent_ref(self, parent_id):
+        if parent_id in self.blocks:
+            return {"type": "block_id", "block_id": parent_id}
+        return {"type": "page_id", "page_id": parent_id}
+
+    def _touch(self, bid):
+        """Bump last_edited_time of a block and everything above it up to the page."""
+        now = _now()
+        while bid in self.blocks:
+            self.blocks[bid]["last_edited_time"] = now
+            parent = self.blocks[bid]["parent"]
+            bid = parent.get("block_id") or parent.get("page_id")
+        self.pages.setdefault(bid, {"title": "Untitled"})["last_edited_time"] = now
+
+    def _get(self, bid):
+        if bid not in self.blocks:
+            raise NotionError(404, "object_not_found",
+                              f"Could not find block with ID: {bid}. Make sure the relevant pages "
+                              f"and databases are shared with your integration.")
+        return self.blocks[bid]
+
+    def _editable(self, bid):
+        """Reject writes to archived blocks, including blocks below a deleted one."""
+        while bid in self.blocks:
+            block = self.blocks[bid]
+            if block["archived"]:
+                raise NotionError(400, "validation_error",
+                                  "Can't edit block that is archived. You must unarchive the block "
+                                  "before editing.")
+            bid = block["parent"].get("block_id")
+
+    # Endpoints
+    def append(self, parent_id, body):
+        kids = (body or {}).get("children")
+        if not isinstance(kids, list):
+            raise NotionError(400, "validation_error", "body failed validation: body.children should be defined.")
+        total = self._check_blocks(kids)
+        if total > MAX_REQUEST_BLOCKS:
+            raise NotionError(400, "validation_error",
+                              f"body failed validation: request should contain ≤ `{MAX_REQUEST_BLOCKS}` "
+                              f"blocks, instead was `{total}`.")
+        with self.lock:
+            self._editable(parent_id)
+            siblings = self.children.setdefault(parent_id, [])
+            position = body.get("position") or {"type": "end"}
+            if position["type"] == "end":
+                at = len(siblings)
+            elif position["type"] == "start":
+                at = 0
+            elif position["type"] == "after_block":
+                after = position["after_block"]["id"]
+                if after not in siblings:
+                    raise NotionError(400, "validation_error",
+                                      f"Block {after} is not a child of {parent_id}.")
+                at = siblings.index(after) + 1
+            else:
+                raise NotionError(400, "validation_error", "body failed validation: body.position.type.")
+            parent = self._parent_ref(parent_id)
+            ids = [self._store(parent, kid) for kid in kids]
+            siblings[at:at] = ids
+            self._touch(parent_id)
+            return {"object": "list", "results": [self._view(i) for i in ids],
+                    "next_cursor": None, "has_more": False, "type": "block", "block": {}}
+
+    def list(self, parent_id, query):
+        size = min(int(query.get("page_size", ["100"])[0]), 100)
+        cursor = query.get("start_cursor", [None])[0]
+        with self.lock:
+            siblings = self.children.get(parent_id, [])
+            start = siblings.index(cursor) if cursor in siblings else 0
+            page = siblings[start:start + size]
+            more = start + size < len(siblings)
+            return {"object": "list", "results": [self._view(i) for i in page],
+                    "next_cursor": siblings[start + size] if more else None,
+                    "has_more": more, "type": "block", "block": {}}
+
+    def page(self, page_id):
+        with self.lock:
+            if page_id in self.blocks:
+                raise NotionError(400, "validation_error", f"{page_id} is a block, not a page.")
+            self.pages.setdefault(page_id, {"title": "Untitled", "last_edited_time": _now()})
+            return self._page_view(page_id)
+
+    def _page_view(self, page_id):
+        page = self.pages[page_id]
+        properties = page.get("properties")
+        if properties is None:
+            title = [self._segment({"type": "text", "text": {"content": page["title"]}})]
+            properties = {"title": {"id": "title", "type": "title", "title": title}}
+        return {"object": "page", "id": page_id, "last_edited_time": page["last_edited_time"],
+                "parent": page.get("parent", {"type": "workspace", "workspace": True}),
+                "in_trash": False, "properties": json.loads(json.dumps(properties))}
+
+    # Data sources: schema is {property name: {"id", "name", "type", <type>: {}}}
+    def add_data_source(self, ds_id, properties):
+        """Create a data source with {property name: type}; exactly one must be "title"."""
+        schema = {name: {"id": f"p{i}", "name": name, "type": ptype, ptype: {}}
+                  for i, (name, ptype) in enumerate(properties.items())}
+        with self.lock:
+            self.data_sources[ds_id] = {"properties": schema, "pages": []}
+
+    def _data_source(self, ds_id):
+        if ds_id not in self.data_sources:
+            raise NotionError(404, "object_not_found",
+                              f"Could not find data_source with ID: {ds_id}. Make sure the relevant "
+                              f"pages and databases are shared with your integration.")
+        return self.data_sources[ds_id]
+
+    def _property_values(self, schema, properties):
+        """Validate request-shaped property values and return them response-shaped."""
+        values = {}
+        for name, value in (properties or {}).items():
+            prop = schema.get(name)
+            if prop is None:
+                raise NotionError(400, "validation_error", f"{name} is not a property that exists.")
+            ptype = prop["type"]
+            if ptype not in value:
+                raise NotionError(400, "validation_error",
+                                  f"{name} is expected to be {ptype}.")
+            data = value[ptype]
+            if ptype in ("title", "rich_text"):
+                self._check_rich_text(data, f"body.properties.{name}.{ptype}")
+                data = [self._segment(s) for s in data]
+            values[name] = {"id": prop["id"], "type": ptype, ptype: data}
+        return values
+
+    def create_page(self, body):
+        parent = (body or {}).get("parent") or {}
+        kids = body.get("children")
+        if kids is not None:
+            total = self._check_blocks(kids)
+            if total > MAX_REQUEST_BLOCKS:
+                raise NotionError(400, "validation_error",
+                                  f"body failed validation: request should contain ≤ "
+                                  f"`{MAX_REQUEST_BLOCKS}` blocks, instead was `{total}`.")
+        with self.lock:
+            page_id = str(uuid.uuid4())
+            if "data_source_id" in parent:
+                source = self._data_source(parent["data_source_id"])
+                properties = self._property_values(source["properties"], body.get("properties"))
+                for name, prop in source["properties"].items():
+                    if name not in properties:
+                        empty = [] if prop["type"] in ("title", "rich_text", "multi_select",
+                                                       "people", "relation", "files") else None
+                        properties[name] = {"id": prop["id"], "type": prop["type"], prop["type"]: empty}
+                source["pages"].append(page_id)
+                parent = {"type": "data_source_id", "data_source_id": parent["data_source_id"]}
+            elif "page_id" in parent:
+                properties = self._property_values(
+                    {"title": {"id": "title", "type": "title"}}, body.get("properties"))
+                parent = {"type": "page_id", "page_id": parent["page_id"]}
+            else:
+                raise NotionError(400, "validation_error", "body failed validation: body.parent should be defined.")
+            self.pages[page_id] = {"title": "Untitled", "last_edited_time": _now(),
+                                   "parent": parent, "properties": properties}
+            self.children[page_id] = []
+        if kids:
+            self.append(page_id, {"children": kids})
+        with self.lock:
+            return self._page_view(page_id)
+
+    def update_page(self, page_id, body):
+        with self.lock:
+            page = self.pages.get(page_id)
+            if page is None or "properties" not in page:
+                raise NotionError(404, "object_not_found", f"Could not find page with ID: {page_id}.")
+            schema = (self.data_sources[page["parent"]["data_source_id"]]["properties"]
+                      if "data_source_id" in page["parent"] else {"title": {"id": "title", "type": "title"}})
+            page["properties"].update(self._property_values(schema, (body or {}).get("properties")))
+            page["last_edited_time"] = _now()
+            return self._page_view(page_id)
+
+    def retrieve_data_source(self, ds_id):
+        with self.lock:
+            source = self._data_source(ds_id)
+            return {"object": "data_source", "id": ds_id,
+                    "properties": json.loads(json.dumps(source["properties"]))}
+
+    def query(self, ds_id, body):
+        """Query a data source's pages in creation order (filters and sorts are ignored)."""
+        body = body or {}
+        size = min(int(body.get("page_size", 100)), 100)
+        with self.lock:
+            pages = self._data_source(ds_id)["pages"]
+            cursor = body.get("start_cursor")
+            start = pages.index(cursor) if cursor in pages else 0
+            more = start + size < len(pages)
+            return {"object": "list", "results": [self._page_view(p) for p in pages[start:start + size]],
+                    "next_cursor": pages[start + size] if more else None, "has_more": more,
+                    "type": "page_or_data_source", "page_or_data_source": {}}
+
+    # File uploads
+    def _upload_status(self, upload_id):
+        upload = self.uploads.get(upload_id)
+        if upload is None:
+            return None
+        if not upload["_attached"] and upload["status"] in ("pending", "uploaded") \
+                and time.time() > upload["_expires"]:
+            upload["status"] = "expired"
+        return upload["status"]
+
+    def _upload(self, upload_id):
+        if self._upload_status(upload_id) is None:
+            raise NotionError(404, "object_not_found", f"Could not find file_upload with ID: {upload_id}.")
+        return self.uploads[upload_id]
+
+    def _upload_view(self, upload_id):
+        upload = self.uploads[upload_id]
+        view = {k: v for k, v in upload.items() if not k.startswith("_")}
+        view["expiry_time"] = None if upload["_attached"] else _now(upload["_expires"] - time.time())
+        return json.loads(json.dumps(view))
+
+    def create_upload(self, body):
+        body = body or {}
+        mode = body.get("mode", "single_part")
+        if mode not in ("single_part", "multi_part"):
+            raise NotionError(400, "validation_error", f"Unsupported file upload mode: {mode}.")
+        parts = body.get("number_of_parts")
+        if (mode == "multi_part") != (parts is not None) or (parts is not None and not 1 <= parts <= 1000):
+            raise NotionError(400, "validation_error",
+                              "body failed validation: number_of_parts is required for (and only "
+                              "for) multi_part uploads and must be between 1 and 1000.")
+        upload_id = str(uuid.uuid4())
+        with self.lock:
+            self.uploads[upload_id] = {
+                "object": "file_upload", "id": upload_id, "created_time": _now(), "status": "pending",
+                "filename": body.get("filename") or "file", "content_type": body.get("content_type"),
+                "content_length": None, "mode": mode,
+                "upload_url": f"https://api.notion.com/v1/file_uploads/{upload_id}/send",
+                "number_of_parts": {"total": parts or 1, "sent": 0},
+                "_parts": {}, "_expires": time.time() + UPLOAD_EXPIRY, "_attached": False,
+            }
+            return self._upload_view(upload_id)
+
+    def send_upload(self, upload_id, form):
+        file = (form or {}).get("file")
+        if not isinstance(file, tuple):
+            raise NotionError(400, "validation_error", "multipart body has no `file` field.")
+        content = file[1]
+        if len(content) > MAX_FILE_PART:
+            raise NotionError(400, "validation_error",
+                              f"File part too large: {len(content)} bytes (limit {MAX_FILE_PART}).")
+        with self.lock:
+            upload = self._upload(upload_id)
+            if upload["status"] != "pending":
+                raise NotionError(400, "validation_error",
+                                  f"File upload {upload_id} is {upload['status']}, not pending.")
+            total = upload["number_of_parts"]["total"]
+            if upload["mode"] == "multi_part":
+                try:
+                    number = int(form.get("part_number", ""))
+                except ValueError:
+                    number = 0
+                if not 1 <= number <= total:
+                    raise NotionError(400, "validation_error",
+                                      f"part_number must be between 1 and {total}.")
+                if number < total and len(content) < MIN_FILE_PART:
+                    raise NotionError(400, "validation_error",
+                                      f"Part {number} is {len(content)} bytes; every part but the "
+                                      f"last must be at least {MIN_FILE_PART}.")
+            else:
+                number = 1
+            upload["_parts"][number] = content
+            upload["number_of_parts"]["sent"] = len(upload["_parts"])
+            if upload["mode"] == "single_part":
+                upload["status"] = "uploaded"
+                upload["content_length"] = len(content)
+            return self._upload_view(upload_id)
+
+    def complete_upload(self, upload_id):
+        with self.lock:
+            upload = self._upload(upload_id)
+            if upload["mode"] != "multi_part" or upload["status"] != "pending":
+                raise NotionError(400, "validation_error",
+                                  f"File upload {upload_id} cannot be completed.")
+            total = upload["number_of_parts"]["total"]
+            if sorted(upload["_parts"]) != list(range(1, total + 1)):
+                raise NotionError(400, "validation_error",
+                                  f"Sent {len(upload['_parts'])} of {total} parts.")
+            upload["status"] = "uploaded"
+            upload["content_length"] = sum(len(upload["_parts"][n]) for n in range(1, total + 1))
+            return self._upload_view(upload_id)
+
+    def retrieve_upload(self, upload_id):
+        with self.lock:
+            self._upload(upload_id)
+            return self._upload_view(upload_id)
+
+    def file_content(self, upload_id):
+        """The bytes of a completed upload (for checks from Python)."""
+        upload = self.uploads[upload_id]
+        return b"".join(upload["_parts"][n] for n in sorted(upload["_parts"]))
+
+    def retrieve(self, bid):
+        with self.lock:
+            self._get(bid)
+            return self._view(bid)
+
+    def update(self, bid, body):
+        with self.lock:
+            block = self._get(bid)
+            self._editable(bid)
+            btype = block["type"]
+            if btype in (body or {}):
+                changes = body[btype]
+                self._check_rich_text(changes.get("rich_text", []), f"body.{btype}.rich_text")
+                for k, v in changes.items():
+                    if k == "rich_text":
+                        v = [self._segment(s) for s in v]
+                    elif k == "cells":
+                        v = [[self._segment(s) for s in cell] for cell in v]
+                    block[btype][k] = v
+            self._touch(bid)
+            return self._view(bid)
+
+    def delete(self, bid):
+        with self.lock:
+            block = self._get(bid)
+            parent = block["parent"].get("block_id") or block["parent"].get("page_id")
+            siblings = self.children.get(parent, [])
+            if bid in siblings:
+                siblings.remove(bid)
+            block["archived"] = block["in_trash"] = True
+            self._touch(bid)
+            return self._view(bid)
+
+    def dispatch(self, method, path, body):
+        """Route one API request to the store; raises NotionError for API errors."""
+        parts = urlsplit(path)
+        segments = parts.path.strip("/").split("/")
+        if segments[:1] == ["v1"]:
+            segments = segments[1:]
+        query = parse_qs(parts.query)
+        if segments == ["pages"] and method == "POST":
+            return self.create_page(body)
+        if segments[:1] == ["pages"] and len(segments) == 2 and method == "GET":
+            return self.page(segments[1])
+        if segments[:1] == ["pages"] and len(segments) == 2 and method == "PATCH":
+            return self.update_page(segments[1], body)
+        if segments[:1] == ["data_sources"] and len(segments) == 2 and method == "GET":
+            return self.retrieve_data_source(segments[1])
+        if segments[:1] == ["data_sources"] and segments[2:] == ["query"] and method == "POST":
+            return self.query(segments[1], body)
+        if segments == ["file_uploads"] and method == "POST":
+            return self.create_upload(body)
+        if segments[:1] == ["file_uploads"] and len(segments) == 2 and method == "GET":
+            return self.retrieve_upload(segments[1])
+        if segments[:1] == ["file_uploads"] and segments[2:] == ["send"] and method == "POST":
+            return self.send_upload(segments[1], body)
+        if segments[:1] == ["file_uploads"] and segments[2:] == ["complete"] and method == "POST":
+            return self.complete_upload(segments[1])
+        if segments[:1] != ["blocks"] or len(segments) not in (2, 3):
+            raise NotionError(400, "invalid_request_url", "Invalid request URL.")
+        bid = segments[1]
+        if len(segments) == 3 and segments[2] == "children":
+            if method == "PATCH":
+                return self.append(bid, body)
+            if method == "GET":
+                return self.list(bid, query)
+        elif len(segments) == 2:
+            if method == "GET":
+                return self.retrieve(bid)
+            if method == "PATCH":
+                return self.update(bid, body)
+            if method == "DELETE":
+                return self.delete(bid)
+        raise NotionError(400, "invalid_request", f"Unsupported request: {method} {parts.path}")
+
+    def reset(self):
+        with self.lock:
+            self.blocks.clear()
+            self.children.clear()
+            self.pages.clear()
+            self.uploads.clear()
+            for source in self.data_sources.values():
+                source["pages"].clear()
+
+
+# ── Server ─────────────────────────────────────────────────────────
+
+class FakeNotion:
+    """A BlockStore behind a threaded HTTP/1.1 server with latency and 429s.
+
+    Use as a context manager from Python (benchmarks, scripted checks):
+        with FakeNotion(latency=0.05) as fake:
+            upload.BASE = fake.base_url
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, jitter=0.0, rps=None,
+                 burst=10, inject_429=0.0, retry_after=1, seed=None):
+        self.store = BlockStore()
+        self.latency = latency
+        self.jitter = jitter
+        self.rps = rps
+        self.burst = burst
+        self.inject_429 = inject_429
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+        self.stats = {}
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] = self.stats.get(key, 0) + amount
+
+    def _admit(self):
+        """Decide whether a request is rate limited and how long it waits."""
+        with self.lock:
+            delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+            if self.inject_429 and self.random.random() < self.inject_429:
+                return False, delay
+            if self.rps:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rps)
+                self.last = now
+                if self.tokens < 1:
+                    return False, delay
+                self.tokens -= 1
+            return True, delay
+
+    def dispatch(self, method, path, body):
+        """Route one API request to the store; raises NotionError for API errors."""
+        return self.store.dispatch(method, path, body)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload, headers=()):
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True  # client gave up (timeout, cancelled task)
+
+            def _error(self, status, code, message, headers=()):
+                self._reply(status, {"object": "error", "status": status, "code": code,
+                                     "message": message}, headers)
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                raw = self.rfile.read(length) if length else b""
+                if self.path == "/__stats":
+                    return self._reply(200, dict(fake.stats))
+                if self.path == "/__reset":
+                    fake.store.reset()
+                    with fake.lock:
+                        fake.stats.clear()
+                    return self._reply(200, {})
+
+                fake._count("requests")
+                fake._count(f"{self.command} {self._endpoint()}")
+                fake._count("bytes_in", length)
+                allowed, delay = fake._admit()
+                if delay:
+                    time.sleep(delay)
+                if not allowed:
+                    fake._count("rate_limited")
+                    return self._error(429, "rate_limited",
+                                       "You have been rate limited. Please try again in a few minutes.",
+                                       [("Retry-After", f"{fake.retry_after:g}")])
+                content_type = self.headers.get("Content-Type", "")
+                form = content_type.startswith("multipart/form-data")
+                if length > MAX_PAYLOAD_BYTES and not form:
+                    fake._count("rejected")
+                    return self._error(413, "validation_error",
+                                       f"Request body too large: {length} bytes "
+                                       f"(limit {MAX_PAYLOAD_BYTES}).")
+                try:
+                    body = parse_form(raw, content_type) if form else json.loads(raw) if raw else None
+                    result = fake.dispatch(self.command, self.path, body)
+                except NotionError as e:
+                    fake._count("rejected")
+                    return self._error(e.status, e.code, str(e))
+                except ValueError:
+                    fake._count("rejected")
+                    return self._error(400, "invalid_json", "Error parsing JSON body.")
+                except Exception as e:
+                    fake._count("errors")
+                    return self._error(500, "internal_server_error", repr(e))
+                self._reply(200, result)
+
+            def _endpoint(self):
+                segments = urlsplit(self.path).path.strip("/").split("/")
+                if segments[:1] == ["v1"]:
+                    segments = segments[1:]
+                return "/" + "/".join("{id}" if i == 1 else s for i, s in enumerate(segments))
+
+            do_GET = do_PATCH = do_DELETE = do_POST = _handle
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+# ── In-process Transport ───────────────────────────────────────────
+
+class LocalPool:
+    """Drop-in for upload.ConnectionPool that answers from a BlockStore.
+
+    No sockets or threads: requests still go through upload.py's encoding,
+    limits, retries and METRICS, but the store is called directly, so
+    benchmarks measure the uploader rather than the loopback stack:
+        pool = LocalPool()
+        upload.BASE = pool.base_url
+        upload.POOL = pool
+    """
+
+    base_url = "local://fake_server/v1"
+
+    def __init__(self, store=None):
+        self.store = store or BlockStore()
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "opened": 0, "reused": 0, "closed": 0}
+
+    def request(self, method, path, body=None, headers=None):
+        """Answer one request; returns (status, headers, body bytes)."""
+        with self.lock:
+            self.counts["requests"] += 1
+            self.counts["reused"] += 1
+        content_type = (headers or {}).get("Content-Type", "")
+        form = content_type.startswith("multipart/form-data")
+        try:
+            if body and len(body) > MAX_PAYLOAD_BYTES and not form:
+                raise NotionError(413, "validation_error",
+                                  f"Request body too large: {len(body)} bytes "
+                                  f"(limit {MAX_PAYLOAD_BYTES}).")
+            body = parse_form(body, content_type) if form else json.loads(body) if body else None
+            result = self.store.dispatch(method, path, body)
+        except NotionError as e:
+            status, result = e.status, {"object": "error", "status": e.status,
+                                        "code": e.code, "message": str(e)}
+        else:
+            status = 200
+        return status, {"Content-Type": "application/json"}, json.dumps(result).encode()
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, idle=0)
+
+    def close(self):
+        pass
+
+
+# ── Main ───────────────────────────────────────────────────────────
+
+def _pop_option(args, name, default=None):
+    """Remove `name value` from args and return the value (or default)."""
+    if name not in args:
+        return default
+    i = args.index(name)
+    value = args[i + 1]
+    del args[i:i + 2]
+    return value
+
+
+if __name__ == "__main__":
+    args = sys.argv[1:]
+    rps = _pop_option(args, "--rps")
+    seed = _pop_option(args, "--seed")
+    fake = FakeNotion(
+        port=int(_pop_option(args, "--port", 8765)),
+        latency=float(_pop_option(args, "--latency", 0)),
+        jitter=float(_pop_option(args, "--jitter", 0)),
+        rps=float(rps) if rps else None,
+        burst=int(_pop_option(args, "--burst", 10)),
+        inject_429=float(_pop_option(args, "--inject-429", 0)),
+        retry_after=float(_pop_option(args, "--retry-after", 1)),
+        seed=int(seed) if seed is not None else None,
+    )
+    data_sources = _pop_option(args, "--data-sources")
+    if args:
+        sys.exit(f"Unknown arguments: {' '.join(args)}")
+    if data_sources:
+        with open(data_sources, encoding="utf-8") as f:
+            for ds_id, properties in json.load(f).items():
+                fake.store.add_data_source(ds_id, properties)
+    print(f"Fake Notion API on {fake.base_url} (Ctrl-C to stop)")
+    try:
+        fake.server.serve_forever()
+    except KeyboardInterrupt:
+        fake.server.server_close()
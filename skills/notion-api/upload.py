@@ -2,23 +2,91 @@
 """Direct Markdown → Notion API upload. No intermediate format.
 
 Parses standard markdown and builds Notion block tree from heading hierarchy.
-H1 (toggle) > H2 (toggle) > H3 (toggle) > Content.
+H1 (toggle) > H2 (toggle) > H3 (toggle) > Content. H4+ map onto H3 toggles.
 First H1 is removed (page title). All others become toggle headings.
 
 Usage:
     uv run upload.py <markdown_file> <page_id> [title]
     uv run upload.py --config <dotted.path> <markdown_file> [title]
 
+    uv run upload.py --dir <directory> [--config pages]
+
+    uv run upload.py --export <page_id> [output.md]
+    uv run upload.py --export --config <dotted.path> [output.md]
+
+    uv run upload.py --import <file.csv|directory> <data_source_id> [--key Property]
+    uv run upload.py --import <file.csv|directory> --config databases.<key> [--key Property]
+
 Config mode reads the page ID from .claude/config/notion.json.
 Example: uv run upload.py --config pages.my-page <markdown_file>
+Directory mode publishes every <key>.md below the directory to pages.<key>
+and turns links between those files into page mentions. Export mode writes
+a page back as markdown (stdout by default) that uploads to the same tree.
+Import mode creates one data source page per CSV row or front-matter
+markdown file (see import_source). Images and attachments on a line of
+their own (`![alt](diagram.png)`, `[Spec](spec.pdf)`) are uploaded once
+per content and reused by ID (see upload_media).
+
+Set NOTION_BASE_URL (or "base_url" in the config) to use a local stand-in
+such as fake_server.py instead of api.notion.com.
+
+Flags:
+    --append    Append to the page instead of replacing its content.
+    --sync      Diff against the current page and only send changed blocks.
+    --stream    Upload sections while the rest of the file is still parsed.
+    --resume    Finish an interrupted upload from its journal.
+    --force     Publish even if the page and file are unchanged since the last
+                publish (see PUBLISHED).
+    --blue-green
+                Build the new content below the old one and delete the old
+                blocks only once it is complete and verified, so the page is
+                never empty and a failed build leaves it as it was. Not
+                atomic: the build shows below the old content, and the swap
+                takes one DELETE per old top-level block (publish_blue_green).
+    --plan FILE Write the compiled request plan as JSON instead of uploading.
+    --key NAME  With --import: update the page whose NAME property matches
+                instead of creating one (default: "key" of the config entry).
+    --watch     Stay running and re-publish changed sections on every save
+                (single file or --dir).
+    --profile   Print request, retry, sleep and parse timings at the end.
+    --trace FILE
+                Write a Chrome trace (chrome://tracing, Perfetto) with the
+                same metrics as JSON.
+    --rps N     Starting request rate shared by all calls (default 3/s). It
+                adapts to 429s and latency between N/4 and 4N (AdaptiveLimiter).
+    --fixed-rate
+                Keep the rate at --rps instead of adapting it.
+    --workers N Most concurrent requests during uploads (default 16; the
+                adaptive limiter starts at 4 in flight and grows from there).
+    --deep-headings flatten|nest
+                H4+ become H3 siblings (flatten, default) or nested H3 toggles.
 """
+import asyncio
+import csv
+import difflib
+import functools
+import hashlib
+import heapq
 import json
 import os
+import posixpath
+import queue
+import random
 import re
+import select
+import ssl
 import sys
+import threading
 import time
-import urllib.request
+import http.client
+import io
+import mimetypes
 import urllib.error
+import urllib.parse
+from concurrent.futures import (
+    FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait,
+)
+from datetime import datetime, timedelta, timezone
 
 # ── Config ────────────────────────────────────────────────────────
 
@@ -100,6 +168,11 @@ def resolve_config_path(config, path):
     return obj
 
 
+def page_id_of(entry):
+    """Page ID from a config entry: either the ID itself or {"id": ...}."""
+    return entry["id"] if isinstance(entry, dict) else entry
+
+
 # Module level — no interactive side effects at import time
 CONFIG = TOKEN = HEADERS = BASE = None
 API_VERSION = "2025-09-03"
@@ -116,56 +189,98 @@ def _ensure_init():
         "Content-Type": "application/json",
         "Notion-Version": API_VERSION,
     }
-    BASE = "https://api.notion.com/v1"
+    # NOTION_BASE_URL / "base_url" point uploads at a stand-in such as fake_server.py
+    BASE = (os.environ.get("NOTION_BASE_URL") or CONFIG.get("base_url")
+            or "https://api.notion.com/v1").rstrip("/")
 
 
 # ── Rich Text ──────────────────────────────────────────────────────
 
-def parse_rich_text(text):
-    """Parse markdown inline formatting into Notion rich_text array."""
+RICH_TEXT_CHUNK = 1990   # conservative per-segment limit
+MAX_RICH_TEXT = 100      # segments per rich_text array
+RICH_TEXT_CACHE_SIZE = 1024  # distinct short strings (table cells, boilerplate lines)
+RICH_TEXT_CACHE_MAX = 80     # longer strings are rarely repeated
+
+# Inline markup can only start at one of these; the alternatives are tried
+# there in this order (bold+italic before bold before italic, like finditer)
+_INLINE_START = re.compile(r"[*`\[]")
+_INLINE = re.compile(
+    r"\*\*\*(.+?)\*\*\*"
+    r"|\*\*(.+?)\*\*"
+    r"|\*(.+?)\*"
+    r"|`([^`]+)`"
+    r"|\[([^\]]+)\]\(([^)]+)\)"
+)
+_STYLES = {1: {"bold": True, "italic": True}, 2: {"bold": True}, 3: {"italic": True}, 4: {"code": True}}
+_SHORT_TEXT = RICH_TEXT_CHUNK // 12  # widest JSON escape is 12 chars: always fits one segment
+
+
+def _text_segments(content, annotations=None, link=None):
+    """Text segments for content, split so each fits RICH_TEXT_CHUNK once JSON-encoded."""
+    segments = []
+    for chunk in split_json_chunks(content) if len(content) > _SHORT_TEXT else (content,):
+        segment = {"type": "text", "text": {"content": chunk, "link": link} if link else {"content": chunk}}
+        if annotations:
+            segment["annotations"] = dict(annotations)
+        segments.append(segment)
+    return segments
+
+
+def _tokenize_rich_text(text):
+    candidate = _INLINE_START.search(text)
+    if candidate is None:  # no markup at all: the common case
+        return _text_segments(text) if text else [{"type": "text", "text": {"content": text}}]
     segments = []
-    pattern = re.compile(
-        r'(\*\*\*(.+?)\*\*\*)'
-        r'|(\*\*(.+?)\*\*)'
-        r'|(\*(.+?)\*)'
-        r'|(`([^`]+)`)'
-        r'|(\[([^\]]+)\]\(notion://([^)]+)\))'
-        r'|(\[([^\]]+)\]\(([^)]+)\))'
-    )
+    append = segments.append
     pos = 0
-    for m in pattern.finditer(text):
-        if m.start() > pos:
-            plain = text[pos:m.start()]
-            if plain:
-                segments.append({"type": "text", "text": {"content": plain}})
-        if m.group(2):
-            segments.append({"type": "text", "text": {"content": m.group(2)},
-                             "annotations": {"bold": True, "italic": True}})
-        elif m.group(4):
-            segments.append({"type": "text", "text": {"content": m.group(4)},
-                             "annotations": {"bold": True}})
-        elif m.group(6):
-            segments.append({"type": "text", "text": {"content": m.group(6)},
-                             "annotations": {"italic": True}})
-        elif m.group(8):
-            segments.append({"type": "text", "text": {"content": m.group(8)},
-                             "annotations": {"code": True}})
-        elif m.group(10):
-            segments.append({"type": "mention",
-                             "mention": {"page": {"id": m.group(11)}}})
-        elif m.group(12):
-            segments.append({"type": "text",
-                             "text": {"content": m.group(13), "link": {"url": m.group(14)}}})
+    while candidate:
+        start = candidate.start()
+        m = _INLINE.match(text, start)
+        if m is None:
+            candidate = _INLINE_START.search(text, start + 1)
+            continue
+        if start > pos:
+            plain = text[pos:start]
+            if len(plain) > _SHORT_TEXT:
+                segments += _text_segments(plain)
+            else:
+                append({"type": "text", "text": {"content": plain}})
+        group = m.lastindex
+        if group <= 4:
+            content = m.group(group)
+            if len(content) > _SHORT_TEXT:
+                segments += _text_segments(content, _STYLES[group])
+            else:
+                append({"type": "text", "text": {"content": content},
+                        "annotations": dict(_STYLES[group])})
+        else:
+            label, url = m.group(5, 6)
+            if url.startswith("notion://") and len(url) > 9:
+                append({"type": "mention", "mention": {"page": {"id": url[9:]}}})
+            else:
+                segments += _text_segments(label, link={"url": url})
         pos = m.end()
+        candidate = _INLINE_START.search(text, pos)
     if pos < len(text):
-        remaining = text[pos:]
-        if remaining:
-            segments.append({"type": "text", "text": {"content": remaining}})
-    if not segments:
-        segments.append({"type": "text", "text": {"content": text}})
+        segments += _text_segments(text[pos:])
     return segments
 
 
+_cached_rich_text = functools.lru_cache(maxsize=RICH_TEXT_CACHE_SIZE)(_tokenize_rich_text)
+
+
+def parse_rich_text(text):
+    """Parse markdown inline formatting into Notion rich_text array.
+
+    Single pass over the candidate markup characters; text longer than a
+    segment allows is split like code (see split_json_chunks). Results for
+    short strings are memoized and shared, so treat them as read-only.
+    """
+    if len(text) <= RICH_TEXT_CACHE_MAX:
+        return _cached_rich_text(text)
+    return _tokenize_rich_text(text)
+
+
 # ── Block Factories ────────────────────────────────────────────────
 
 def mk_paragraph(text):
@@ -187,62 +302,209 @@ def mk_todo(text, checked=False):
 def mk_quote(text):
     return {"type": "quote", "quote": {"rich_text": parse_rich_text(text)}}
 
+# Notion limits rich_text content to 2000 chars measured by JSON-encoded length.
+# Non-ASCII chars (e.g. ═, ä, 🟡) expand to \uXXXX in JSON (6 chars → 1 Python char).
+
+def _escape_boundary(encoded, cut):
+    """Move cut back so it does not split an escape sequence of encoded."""
+    b = encoded.rfind("\\", max(0, cut - 5), cut)
+    if b < 0:
+        return cut
+    run_start = b
+    while run_start > 0 and encoded[run_start - 1] == "\\":
+        run_start -= 1
+    if (b - run_start) % 2:
+        return cut  # b is the second half of an escaped backslash
+    token_len = 6 if encoded[b + 1] == "u" else 2
+    return b if b + token_len > cut else cut
+
+
+def split_json_chunks(text, limit=RICH_TEXT_CHUNK):
+    """Split text into the longest pieces whose JSON-encoded length fits limit.
+
+    Linear time in C-speed steps: each piece costs one json.dumps of a
+    window. If the encoded window is too long, it is cut at the limit (moved
+    back to an escape boundary) and decoded again, which yields exactly the
+    chars that fit. After a cut the next window is sized from the last
+    piece, so escape-heavy text is not over-encoded.
+    """
+    chunks = []
+    start, n = 0, len(text)
+    span = limit
+    while start < n:
+        window = text[start:start + span]
+        encoded = json.dumps(window)[1:-1]
+        if len(encoded) <= limit:
+            if span < limit and start + span < n:
+                span = limit  # a narrowed window fit entirely: more may fit
+                continue
+        else:
+            cut = _escape_boundary(encoded, limit)
+            piece = json.loads(f'"{encoded[:cut]}"')
+            if piece and piece[-1] != window[len(piece) - 1]:
+                piece = piece[:-1]  # cut between the halves of a surrogate pair
+            window = piece or window[:1]  # always advance
+            span = min(limit, 2 * len(window))
+        chunks.append(window)
+        start += len(window)
+    return chunks
+
+
 def mk_code(content, language="plain text"):
     lang_map = {"plaintext": "plain text", "": "plain text"}
     language = lang_map.get(language, language)
-    # Notion limits rich_text content to 2000 chars measured by JSON-encoded length.
-    # Non-ASCII chars (e.g. ═, ä, 🟡) expand to \uXXXX in JSON (6 chars → 1 Python char).
-    # We chunk conservatively: accumulate chars until the JSON-encoded chunk would exceed 1990.
-    limit = 1990
-    chunks = []
-    start = 0
-    while start < len(content):
-        # Binary search for the largest end such that json_len <= limit
-        lo, hi = start, min(start + limit, len(content))
-        while lo < hi:
-            mid = (lo + hi + 1) // 2
-            if len(json.dumps(content[start:mid])) - 2 <= limit:  # -2 for surrounding quotes
-                lo = mid
-            else:
-                hi = mid - 1
-        end = lo if lo > start else start + 1  # always advance at least 1 char
-        chunks.append(content[start:end])
-        start = end
-    if not chunks:
-        chunks = [""]
+    chunks = split_json_chunks(content) or [""]
     rich_text = [{"type": "text", "text": {"content": c}} for c in chunks]
     return {"type": "code", "code": {
         "rich_text": rich_text,
         "language": language}}
 
+
+def mk_code_blocks(content, language="plain text"):
+    """Code content of any size as one or more consecutive code blocks.
+
+    A block holds at most MAX_RICH_TEXT segments, so bigger content is split
+    at line boundaries (mid-line only for a single oversized line).
+    """
+    # Every segment but the last is packed to at least limit - 11 (widest char is 12)
+    capacity = (RICH_TEXT_CHUNK - 11) * MAX_RICH_TEXT
+    if len(content) * 12 <= capacity:
+        return [mk_code(content, language)]
+    pieces, current, width = [], [], 0
+    for line in content.split("\n"):
+        w = len(json.dumps(line))  # quotes stand in for the escaped newline
+        if current and width + w > capacity:
+            pieces.append("\n".join(current))
+            current, width = [], 0
+        current.append(line)
+        width += w
+    pieces.append("\n".join(current))
+    blocks = []
+    for piece in pieces:
+        chunks = split_json_chunks(piece) or [""]
+        for i in range(0, len(chunks), MAX_RICH_TEXT):
+            block = mk_code("", language)
+            block["code"]["rich_text"] = [{"type": "text", "text": {"content": c}}
+                                          for c in chunks[i:i + MAX_RICH_TEXT]]
+            blocks.append(block)
+    return blocks
+
 def mk_divider():
     return {"type": "divider", "divider": {}}
 
-def mk_table(rows):
-    width = max(len(r) for r in rows) if rows else 1
-    table_rows = []
-    for row in rows:
-        cells = [parse_rich_text(cell.strip()) for cell in row]
-        while len(cells) < width:
-            cells.append([{"type": "text", "text": {"content": ""}}])
-        table_rows.append({"type": "table_row", "table_row": {"cells": cells}})
+def mk_table_row(row, width):
+    cells = [parse_rich_text(cell.strip()) for cell in row]
+    while len(cells) < width:
+        cells.append([{"type": "text", "text": {"content": ""}}])
+    return {"type": "table_row", "table_row": {"cells": cells}}
+
+def mk_table(rows, width=None):
+    width = width or (max(len(r) for r in rows) if rows else 1)
     return {"type": "table", "table": {
         "table_width": width, "has_column_header": True,
-        "has_row_header": False, "children": table_rows}}
+        "has_row_header": False, "children": [mk_table_row(row, width) for row in rows]}}
+
+MEDIA_TYPES = ("image", "video", "audio", "pdf", "file")
+
+def mk_media(btype, source, caption="", upload=None):
+    """Media block for an external URL, or for a local file once upload_media
+    has uploaded it (`upload` is the file upload ID)."""
+    if upload:
+        data = {"type": "file_upload", "file_upload": {"id": upload}}
+    elif "://" in source:
+        data = {"type": "external", "external": {"url": source}}
+    else:
+        raise ValueError(f"{source}: local file was not uploaded (see upload_media)")
+    if caption:
+        data["caption"] = parse_rich_text(caption)
+    if btype == "file":
+        data["name"] = posixpath.basename(source)
+    return {"type": btype, btype: data}
 
 
 # ── Tree Node ──────────────────────────────────────────────────────
 
 class Node:
+    """One block of the parsed tree, materialized lazily.
+
+    Parsed nodes keep the block factory and its arguments (the source text)
+    instead of the Notion JSON: `block` builds the payload on access, so a
+    huge document stays a compact tree of strings until a batch is
+    serialized. Node(block) wraps a ready-made block dict.
+    """
+    __slots__ = ("type", "build", "args", "children")
+
     def __init__(self, block, children=None):
-        self.block = block
+        self.type = block["type"] if block else None
+        self.build = None
+        self.args = block
         self.children = children or []
+
+    @classmethod
+    def lazy(cls, btype, build, *args):
+        """A node whose block is build(*args), of type btype."""
+        node = cls.__new__(cls)
+        node.type = btype
+        node.build = build
+        node.args = args
+        node.children = []
+        return node
+
+    @property
+    def block(self):
+        return self.args if self.build is None else self.build(*self.args)
+
     def add(self, child):
         self.children.append(child)
 
 
 # ── Markdown Parser (hierarchy from heading levels) ────────────────
 
+# Local links that become file blocks: documents, archives and media. Any
+# other link (`[Homepage](site/index.html)`) stays a paragraph link.
+ATTACHMENT_EXTENSIONS = frozenset((
+    ".pdf", ".doc", ".docx", ".odt", ".rtf", ".xls", ".xlsx", ".ods", ".csv",
+    ".ppt", ".pptx", ".odp", ".key", ".pages", ".numbers", ".epub",
+    ".zip", ".tar", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar"))
+
+# A line that is only an image, or only a link to a local attachment
+_MEDIA_LINE = re.compile(r'^(!?)\[([^\]]*)\]\(\s*<?([^)\s>]+)>?(?:\s+"[^"]*")?\s*\)$')
+
+
+def _media_node(stripped):
+    """Node for a media line (`![alt](diagram.png)`, `[Spec](spec.pdf)`), else None.
+
+    Images take the block type of their file (image, video, audio, pdf;
+    unknown local files become file blocks); links to local attachments
+    (ATTACHMENT_EXTENSIONS, or image/video/audio files) become file blocks.
+    Local paths stay as written, relative to the markdown file, until
+    upload_media resolves them.
+    """
+    m = _MEDIA_LINE.match(stripped)
+    if m is None:
+        return None
+    image, caption, source = m.groups()
+    remote = "://" in source
+    if not remote:
+        if source.startswith(("#", "mailto:", "notion:")):
+            return None
+        source = urllib.parse.unquote(source)
+    if not image:
+        ext = os.path.splitext(source)[1].lower()
+        kind = (mimetypes.guess_type(source)[0] or "").split("/")[0]
+        if remote or (ext not in ATTACHMENT_EXTENSIONS and kind not in ("image", "video", "audio")):
+            return None
+        return Node.lazy("file", mk_media, "file", source, caption)
+    mime = mimetypes.guess_type(urllib.parse.urlsplit(source).path if remote else source)[0] or ""
+    if mime == "application/pdf":
+        btype = "pdf"
+    elif mime.split("/")[0] in ("image", "video", "audio"):
+        btype = mime.split("/")[0]
+    else:
+        btype = "image" if remote else "file"  # e.g. badge URLs without an extension
+    return Node.lazy(btype, mk_media, btype, source, caption)
+
+
 def parse_lines_to_blocks(lines, start, end):
     """Parse a range of content lines (no headings) into a list of Nodes."""
     nodes = []
@@ -268,7 +530,8 @@ def parse_lines_to_blocks(lines, start, end):
                     break
                 code_lines.append(cl)
                 i += 1
-            nodes.append(Node(mk_code("\n".join(code_lines), lang or "plain text")))
+            for block in mk_code_blocks("\n".join(code_lines), lang or "plain text"):
+                nodes.append(Node(block))
             continue
 
         # Table
@@ -284,12 +547,17 @@ def parse_lines_to_blocks(lines, start, end):
                 cells = [c.strip() for c in tl.split("|")[1:-1]]
                 rows.append(cells)
             if rows:
-                nodes.append(Node(mk_table(rows)))
+                # Rows are child nodes, built when their request is: a long table
+                # is created with its first rows and the rest appended in batches
+                width = max(len(r) for r in rows)
+                table = Node.lazy("table", mk_table, (), width)
+                table.children = [Node.lazy("table_row", mk_table_row, row, width) for row in rows]
+                nodes.append(table)
             continue
 
         # Divider
         if line.strip() == "---":
-            nodes.append(Node(mk_divider()))
+            nodes.append(Node.lazy("divider", mk_divider))
             i += 1
             continue
 
@@ -309,23 +577,23 @@ def parse_lines_to_blocks(lines, start, end):
                     break
             # Join with newlines, collapse multiple blanks, strip edges
             text = "\n".join(quote_parts).strip()
-            nodes.append(Node(mk_quote(text)))
+            nodes.append(Node.lazy("quote", mk_quote, text))
             continue
 
         # Checkbox
         stripped = line.lstrip()
         if stripped.startswith("- [x] "):
-            nodes.append(Node(mk_todo(stripped[6:], checked=True)))
+            nodes.append(Node.lazy("to_do", mk_todo, stripped[6:], True))
             i += 1
             continue
         if stripped.startswith("- [ ] "):
-            nodes.append(Node(mk_todo(stripped[6:], checked=False)))
+            nodes.append(Node.lazy("to_do", mk_todo, stripped[6:], False))
             i += 1
             continue
 
         # Bullet (handle sub-bullets)
         if stripped.startswith("- "):
-            bullet_node = Node(mk_bullet(stripped[2:]))
+            bullet_node = Node.lazy("bulleted_list_item", mk_bullet, stripped[2:])
             i += 1
             while i < end:
                 next_line = lines[i].rstrip("\n")
@@ -333,7 +601,7 @@ def parse_lines_to_blocks(lines, start, end):
                     break
                 indent = len(next_line) - len(next_line.lstrip())
                 if indent >= 2 and next_line.lstrip().startswith("- "):
-                    bullet_node.add(Node(mk_bullet(next_line.lstrip()[2:])))
+                    bullet_node.add(Node.lazy("bulleted_list_item", mk_bullet, next_line.lstrip()[2:]))
                     i += 1
                 else:
                     break
@@ -343,303 +611,3152 @@ def parse_lines_to_blocks(lines, start, end):
         # Numbered list
         m = re.match(r'^(\d+)\. (.+)', stripped)
         if m:
-            nodes.append(Node(mk_numbered(m.group(2))))
+            nodes.append(Node.lazy("numbered_list_item", mk_numbered, m.group(2)))
             i += 1
             continue
 
+        # Image or attachment on a line of its own
+        if stripped[0] in "![":
+            media = _media_node(stripped)
+            if media is not None:
+                nodes.append(media)
+                i += 1
+                continue
+
         # Paragraph
-        nodes.append(Node(mk_paragraph(stripped)))
+        nodes.append(Node.lazy("paragraph", mk_paragraph, stripped))
         i += 1
 
     return nodes
 
 
-def parse_markdown(lines, link_map=None):
+class LinkResolver:
+    """Rewrite `](file.md)` and `](file.md#anchor)` links to page mentions.
+
+    One compiled pattern finds every link target and a dict lookup resolves
+    it, so the cost per line does not grow with the number of mapped files.
+    Build it once and pass it as link_map for every file of a batch.
+    """
+
+    LINK = re.compile(r'\]\(([^)#]*)(#[^)]*)?\)')
+
+    def __init__(self, link_map, base=""):
+        self.link_map = dict(link_map)
+        self.base = base
+
+    def _lookup(self, path, anchor):
+        target = self.link_map.get(path + anchor)
+        if target is None and anchor and path.endswith(".md"):
+            target = self.link_map.get(path)
+        return target
+
+    def _replace(self, m):
+        path, anchor = m.group(1), m.group(2) or ""
+        target = self._lookup(path, anchor)
+        if target is None and path and "://" not in path:
+            target = self._lookup(posixpath.normpath(posixpath.join(self.base, path)), anchor)
+        if target is None:
+            return m.group(0)
+        return f"](notion://{target})"
+
+    def rewrite(self, line):
+        if "](" not in line:
+            return line
+        return self.LINK.sub(self._replace, line)
+
+
+# How headings below H3 are placed (Notion only has heading_1..heading_3):
+#   "flatten" — H4+ become heading_3 toggles at H3 level (siblings of H3)
+#   "nest"    — H4+ become heading_3 toggles nested under the enclosing heading
+DEEP_HEADINGS = "flatten"
+
+
+def _heading_level(stripped):
+    """Level of an ATX heading line ('## Title' → 2), or 0 for other lines."""
+    level = len(stripped) - len(stripped.lstrip("#"))
+    if level and stripped[level:level + 1] == " ":
+        return level
+    return 0
+
+
+def parse_markdown(lines, link_map=None, deep_headings=None):
     """Parse standard markdown into a tree of Nodes using heading hierarchy.
 
     H1 = toggle heading, contains H2 sections.
     H2 = toggle heading, contains H3 sections and content.
     H3 = toggle heading, contains content.
+    H4+ = see DEEP_HEADINGS.
     First H1 is removed (becomes Notion page title).
+    link_map maps file names to page IDs (a dict or a prebuilt LinkResolver).
+    """
+    return list(iter_markdown(lines, link_map, deep_headings))
+
+
+def iter_markdown(lines, link_map=None, deep_headings=None):
+    """Yield the top-level Nodes of parse_markdown as soon as each is complete.
+
+    Single pass with a heading stack: each heading closes every open section
+    of the same or lower rank, so the cost is O(lines). Lines inside code
+    fences are never treated as headings. `lines` may be any iterable (e.g.
+    an open file); only the current top-level section is held in memory.
     """
-    link_map = link_map or {}
-
-    # Replace internal links in all lines
-    if link_map:
-        for idx in range(len(lines)):
-            for fname, target in link_map.items():
-                lines[idx] = lines[idx].replace(f"]({fname})", f"](notion://{target})")
-                # Also handle anchor links
-                if fname.endswith(".md"):
-                    lines[idx] = re.sub(
-                        rf'\]\({re.escape(fname)}#[^)]*\)',
-                        f'](notion://{target})',
-                        lines[idx]
-                    )
-
-    # Remove first H1
+    if link_map and not isinstance(link_map, LinkResolver):
+        link_map = LinkResolver(link_map)
+    deep_headings = deep_headings or DEEP_HEADINGS
+
+    stack = []    # (level, node) of open headings, outermost first
+    pending = []  # content lines since the last heading
+    in_fence = False
     first_h1_removed = False
-    for i, line in enumerate(lines):
-        stripped = line.rstrip("\n").strip()
-        if stripped.startswith("# ") and not stripped.startswith("## "):
-            lines[i] = "\n"
-            first_h1_removed = True
-            break
 
-    # Find all heading positions
-    headings = []  # (line_idx, level, title)
-    for i, line in enumerate(lines):
+    def flush():
+        blocks = parse_lines_to_blocks(pending, 0, len(pending)) if pending else []
+        pending.clear()
+        if stack:
+            stack[-1][1].children.extend(blocks)
+            return []
+        return blocks
+
+    for line in lines:
+        if link_map:
+            line = link_map.rewrite(line)
         stripped = line.rstrip("\n").strip()
-        if stripped.startswith("### "):
-            headings.append((i, 3, stripped[4:]))
-        elif stripped.startswith("## "):
-            headings.append((i, 2, stripped[3:]))
-        elif stripped.startswith("# ") and not stripped.startswith("## "):
-            headings.append((i, 1, stripped[2:]))
-
-    # Build tree
-    top_nodes = []
-    processed_until = 0
-
-    for h_idx, (line_idx, level, title) in enumerate(headings):
-        # Skip headings already processed as children of a parent heading
-        if line_idx < processed_until:
+        if stripped.startswith("```"):
+            in_fence = not in_fence
+        level = 0 if in_fence or stripped.startswith("```") else _heading_level(stripped)
+        if not level:
+            pending.append(line)
             continue
 
-        # Content before this heading (top-level)
-        if line_idx > processed_until:
-            top_nodes.extend(parse_lines_to_blocks(lines, processed_until, line_idx))
+        yield from flush()
+        title = stripped[level + 1:]
 
-        if level == 1:
-            # H1: plain heading, contains H2s
-            next_h1 = None
-            for future_idx, future_level, _ in headings[h_idx + 1:]:
-                if future_level == 1:
-                    next_h1 = future_idx
-                    break
-            section_end = next_h1 if next_h1 is not None else len(lines)
+        # Remove first H1
+        if level == 1 and not first_h1_removed:
+            first_h1_removed = True
+            continue
 
-            # Find H2s within this H1 section
-            h2s_in_section = [(li, lv, t) for li, lv, t in headings
-                              if li > line_idx and li < section_end and lv == 2]
+        if level > 3 and deep_headings == "flatten":
+            level = 3
+        closed = None
+        while stack and stack[-1][0] >= level:
+            closed = stack.pop()[1]
+        if closed is not None and not stack:
+            yield closed  # a top-level section is complete
+        node = Node.lazy(f"heading_{min(level, 3)}", mk_heading, min(level, 3), title, True)
+        if stack:
+            stack[-1][1].add(node)
+        stack.append((level, node))
 
-            h1_node = Node(mk_heading(1, title, toggleable=True))
+    # Remaining content after last heading
+    yield from flush()
+    if stack:
+        yield stack[0][1]
 
-            # Content between H1 and first H2 (or section end)
-            content_start = line_idx + 1
-            first_h2 = h2s_in_section[0][0] if h2s_in_section else section_end
 
-            if content_start < first_h2:
-                h1_node.children.extend(parse_lines_to_blocks(lines, content_start, first_h2))
+# ── Metrics ────────────────────────────────────────────────────────
+
+LATENCY_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+_ID_SEGMENT = re.compile(r"/[0-9a-fA-F]{8}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{4}-?[0-9a-fA-F]{12}(?=/|$)")
 
-            # Process H2s within this H1
-            for h2_sub_idx, (h2_line, _, h2_title) in enumerate(h2s_in_section):
-                if h2_sub_idx + 1 < len(h2s_in_section):
-                    h2_end = h2s_in_section[h2_sub_idx + 1][0]
-                else:
-                    h2_end = section_end
-
-                # Find H3s within this H2
-                h3s_in_h2 = [(li, lv, t) for li, lv, t in headings
-                             if li > h2_line and li < h2_end and lv == 3]
-
-                h2_node = Node(mk_heading(2, h2_title))
-                h2_content_start = h2_line + 1
-                first_h3 = h3s_in_h2[0][0] if h3s_in_h2 else h2_end
-
-                if h2_content_start < first_h3:
-                    h2_node.children.extend(parse_lines_to_blocks(lines, h2_content_start, first_h3))
-
-                for h3_sub_idx, (h3_line, _, h3_title) in enumerate(h3s_in_h2):
-                    if h3_sub_idx + 1 < len(h3s_in_h2):
-                        h3_end = h3s_in_h2[h3_sub_idx + 1][0]
-                    else:
-                        h3_end = h2_end
-
-                    h3_node = Node(mk_heading(3, h3_title))
-                    h3_content_start = h3_line + 1
-                    if h3_content_start < h3_end:
-                        h3_node.children.extend(parse_lines_to_blocks(lines, h3_content_start, h3_end))
-                    h2_node.add(h3_node)
-
-                h1_node.add(h2_node)
-
-            top_nodes.append(h1_node)
-            processed_until = section_end
-
-        elif level == 2:
-            # Standalone H2 (not inside H1): toggle, contains H3s
-            next_h_same_or_higher = None
-            for future_idx, future_level, _ in headings[h_idx + 1:]:
-                if future_level <= 2:
-                    next_h_same_or_higher = future_idx
-                    break
-            section_end = next_h_same_or_higher if next_h_same_or_higher is not None else len(lines)
 
-            h3s_in_section = [(li, lv, t) for li, lv, t in headings
-                              if li > line_idx and li < section_end and lv == 3]
+def _endpoint(path):
+    """Group a request path by endpoint: /blocks/<id>/children?x → /blocks/{id}/children."""
+    return _ID_SEGMENT.sub("/{id}", path.split("?", 1)[0])
 
-            h2_node = Node(mk_heading(2, title))
 
-            content_start = line_idx + 1
-            first_h3 = h3s_in_section[0][0] if h3s_in_section else section_end
+def _percentile(values, q):
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
 
-            if content_start < first_h3:
-                h2_node.children.extend(parse_lines_to_blocks(lines, content_start, first_h3))
 
-            for h3_idx, (h3_line, _, h3_title) in enumerate(h3s_in_section):
-                if h3_idx + 1 < len(h3s_in_section):
-                    h3_end = h3s_in_section[h3_idx + 1][0]
+class Metrics:
+    """Thread-safe counters for one run: requests, retries, sleeps and phases.
+
+    Request latencies are kept per endpoint for percentiles and histograms.
+    With `trace` enabled, every request and phase is also recorded as a
+    Chrome trace event (chrome://tracing, Perfetto) for write().
+    """
+
+    def __init__(self, trace=False):
+        self.lock = threading.Lock()
+        self.trace = trace
+        self.started = time.perf_counter()
+        self.latencies = {}  # "METHOD /endpoint" -> [seconds]
+        self.statuses = {}
+        self.retries = {}
+        self.sleeps = {}
+        self.parse = {}      # file -> seconds
+        self.phases = {}
+        self.gauges = {}     # name -> {value name: {"last", "min", "max"}}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.events = []
+        self.threads = {}
+
+    def _event(self, name, cat, start, seconds, args):
+        tid = self.threads.setdefault(threading.get_ident(), len(self.threads) + 1)
+        self.events.append({
+            "name": name, "cat": cat, "ph": "X", "pid": 1, "tid": tid,
+            "ts": round((start - self.started) * 1e6), "dur": round(seconds * 1e6), "args": args,
+        })
+
+    def request(self, method, path, status, start, sent, received):
+        """Record one HTTP attempt that began at perf_counter() `start`."""
+        seconds = time.perf_counter() - start
+        key = f"{method} {_endpoint(path)}"
+        with self.lock:
+            self.latencies.setdefault(key, []).append(seconds)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+            if self.trace:
+                self._event(key, "request", start, seconds,
+                            {"status": status, "sent": sent, "received": received})
+
+    def retry(self, reason):
+        with self.lock:
+            self.retries[reason] = self.retries.get(reason, 0) + 1
+
+    def slept(self, reason, seconds):
+        with self.lock:
+            self.sleeps[reason] = self.sleeps.get(reason, 0.0) + seconds
+
+    def parsed(self, name, seconds):
+        with self.lock:
+            self.parse[name] = self.parse.get(name, 0.0) + seconds
+
+    def phase(self, name, start, **args):
+        """Record a phase (parse, clear, upload, ...) that began at `start`."""
+        seconds = time.perf_counter() - start
+        with self.lock:
+            self.phases[name] = self.phases.get(name, 0.0) + seconds
+            if self.trace:
+                self._event(name, "phase", start, seconds, args)
+
+    def gauge(self, name, **values):
+        """Record the current values of a changing quantity (e.g. the limiter's rate)."""
+        with self.lock:
+            gauge = self.gauges.setdefault(name, {})
+            for key, value in values.items():
+                g = gauge.get(key)
+                if g is None:
+                    gauge[key] = {"first": value, "last": value, "min": value, "max": value}
                 else:
-                    h3_end = section_end
-
-                h3_node = Node(mk_heading(3, h3_title))
-                h3_content_start = h3_line + 1
-                if h3_content_start < h3_end:
-                    h3_node.children.extend(parse_lines_to_blocks(lines, h3_content_start, h3_end))
-                h2_node.add(h3_node)
-
-            top_nodes.append(h2_node)
-            processed_until = section_end
-
-        elif level == 3:
-            # Standalone H3: toggle
-            next_heading = None
-            for future_idx, _, _ in headings[h_idx + 1:]:
-                next_heading = future_idx
-                break
-            section_end = next_heading if next_heading is not None else len(lines)
+                    g["last"] = value
+                    g["min"] = min(g["min"], value)
+                    g["max"] = max(g["max"], value)
+            if self.trace:
+                tid = self.threads.setdefault(threading.get_ident(), len(self.threads) + 1)
+                self.events.append({
+                    "name": name, "ph": "C", "pid": 1, "tid": tid,
+                    "ts": round((time.perf_counter() - self.started) * 1e6), "args": values,
+                })
+
+    def snapshot(self):
+        """All metrics as a JSON-serializable dict."""
+        with self.lock:
+            endpoints = {}
+            for key, values in sorted(self.latencies.items()):
+                values = sorted(values)
+                histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+                for v in values:
+                    histogram[next((i for i, b in enumerate(LATENCY_BUCKETS_MS) if v * 1000 < b),
+                                   len(LATENCY_BUCKETS_MS))] += 1
+                endpoints[key] = {
+                    "count": len(values), "total_s": sum(values),
+                    "p50_ms": _percentile(values, 0.5) * 1000,
+                    "p95_ms": _percentile(values, 0.95) * 1000,
+                    "max_ms": values[-1] * 1000,
+                    "histogram_ms": dict(zip([f"<{b}" for b in LATENCY_BUCKETS_MS] + ["inf"], histogram)),
+                }
+            return {
+                "wall_s": time.perf_counter() - self.started,
+                "requests": sum(e["count"] for e in endpoints.values()),
+                "endpoints": endpoints,
+                "statuses": {str(k): v for k, v in sorted(self.statuses.items(), key=str)},
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "retries": dict(self.retries),
+                "sleep_s": dict(self.sleeps),
+                "parse_s": dict(self.parse),
+                "phases_s": dict(self.phases),
+                "gauges": {name: {k: dict(v) for k, v in g.items()} for name, g in self.gauges.items()},
+            }
+
+    def summary(self):
+        """Human-readable report of snapshot() for --profile."""
+        snap = self.snapshot()
+        lines = [f"\nProfile ({snap['wall_s']:.2f}s wall)"]
+        if snap["parse_s"]:
+            slowest = sorted(snap["parse_s"].items(), key=lambda kv: -kv[1])[:5]
+            lines.append(f"  Parse      {sum(snap['parse_s'].values()):.2f}s in {len(snap['parse_s'])} files"
+                         + (" (" + ", ".join(f"{n} {s:.2f}s" for n, s in slowest) + ")"
+                            if len(snap["parse_s"]) > 1 else ""))
+        if snap["phases_s"]:
+            lines.append("  Phases     " + ", ".join(f"{k} {v:.2f}s" for k, v in snap["phases_s"].items()))
+        lines.append(f"  Requests   {snap['requests']} ({snap['bytes_sent'] / 1024:.0f} KB sent, "
+                     f"{snap['bytes_received'] / 1024:.0f} KB received)")
+        for key, e in snap["endpoints"].items():
+            lines.append(f"    {key:<32} {e['count']:>5}  p50 {e['p50_ms']:6.0f}ms  "
+                         f"p95 {e['p95_ms']:6.0f}ms  max {e['max_ms']:6.0f}ms")
+        lines.append("  Statuses   " + (", ".join(f"{k}×{v}" for k, v in snap["statuses"].items()) or "-"))
+        lines.append("  Retries    " + (", ".join(f"{k}×{v}" for k, v in snap["retries"].items()) or "-"))
+        for name, gauge in snap["gauges"].items():
+            lines.append(f"  {name.capitalize():<10} " + ", ".join(
+                f"{k} {g['first']:.1f} → {g['last']:.1f} (range {g['min']:.1f}–{g['max']:.1f})"
+                for k, g in gauge.items()))
+        lines.append("  Sleeping   (summed over threads) " + (", ".join(f"{k} {v:.2f}s" for k, v in snap["sleep_s"].items()) or "-"))
+        return "\n".join(lines)
+
+    def write(self, path):
+        """Write a Chrome trace (traceEvents) with the snapshot under "metrics"."""
+        with self.lock:
+            events = list(self.events)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "metrics": self.snapshot()}, f)
+
+
+METRICS = Metrics()
+
+
+# ── Rate Limiting ──────────────────────────────────────────────────
+
+DEFAULT_RPS = 3.0      # Notion's documented average request rate per integration
+DEFAULT_WORKERS = 16   # most concurrent requests during uploads (LIMITER decides how many)
+INITIAL_WINDOW = 4     # requests in flight before AdaptiveLimiter has measured anything
+
+
+class RateLimiter:
+    """Token bucket shared by every API call, safe to use from many threads."""
+
+    def __init__(self, rate=DEFAULT_RPS, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _take(self):
+        """Take a token if one is available; otherwise return (wait, reason)."""
+        with self.lock:
+            return self._take_token(time.monotonic())
+
+    def _take_token(self, now):
+        if now < self.paused_until:
+            return self.paused_until - now, "Retry-After"
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0, None
+        return (1 - self.tokens) / self.rate, "rate limit"
+
+    def acquire(self):
+        """Block until a request may be sent; waits are reported to METRICS."""
+        while True:
+            wait_for, reason = self._take()
+            if not wait_for:
+                return
+            time.sleep(wait_for)
+            METRICS.slept(reason, wait_for)
+
+    async def acquire_async(self):
+        """acquire() for coroutines: waits without blocking the event loop."""
+        while True:
+            wait_for, reason = self._take()
+            if not wait_for:
+                return
+            await asyncio.sleep(wait_for)
+            METRICS.slept(reason, wait_for)
+
+    def pause(self, seconds):
+        """Hold back every caller for `seconds` (e.g. after a 429 with Retry-After)."""
+        with self.lock:
+            until = time.monotonic() + seconds
+            if until > self.paused_until:
+                self.paused_until = until
+                self.tokens = 0
+                self.updated = until
+
+    def done(self, method, path, seconds, status):
+        """Called once per acquire() when the request has finished (or failed)."""
+
+
+AIMD_STEP = 0.5           # requests/s added per second of unthrottled, rate-bound traffic
+AIMD_BACKOFF = 0.5        # rate and window factor on a 429 or a latency spike
+LATENCY_SMOOTHING = 0.2   # weight of the newest sample in an endpoint's latency average
+LATENCY_SPIKE = 2.5       # average latency over this × the endpoint's baseline is congestion
+BACKOFF_COOLDOWN = 1.0    # seconds; responses to requests already in flight don't back off twice
+CONCURRENCY_POLL = 0.02   # seconds between checks while the window is full (coroutines)
+
+
+class AdaptiveLimiter(RateLimiter):
+    """RateLimiter whose rate and concurrency follow the API's responses (AIMD).
+
+    Every finished request reports its latency and status (done()). While
+    responses come back unthrottled and each endpoint's average latency
+    stays near its baseline, the rate grows by AIMD_STEP requests/s per
+    second and the in-flight window by one request per window of responses
+    (only while callers are actually held back by them). A 429, or latency
+    rising past LATENCY_SPIKE × baseline, multiplies both by AIMD_BACKOFF;
+    429s still pause every caller for their Retry-After. The rate stays
+    between min_rate and max_rate (default a quarter and four times the
+    starting rate).
+    """
 
-            h3_node = Node(mk_heading(3, title))
-            content_start = line_idx + 1
-            if content_start < section_end:
-                h3_node.children.extend(parse_lines_to_blocks(lines, content_start, section_end))
+    def __init__(self, rate=DEFAULT_RPS, burst=None, min_rate=None, max_rate=None,
+                 window=INITIAL_WINDOW, max_window=DEFAULT_WORKERS):
+        super().__init__(rate, burst)
+        self.min_rate = min_rate or rate / 4
+        self.max_rate = max_rate or rate * 4
+        self.window = float(min(window, max_window))
+        self.max_window = max_window
+        self.in_flight = 0
+        self.latency = {}  # "METHOD /endpoint" -> [average, baseline] in seconds
+        self.calm_after = 0.0
+        self.freed = threading.Condition(self.lock)
+
+    def _take(self):
+        with self.lock:
+            if self.in_flight >= int(self.window):
+                return CONCURRENCY_POLL, "concurrency"
+            wait = self._take_token(time.monotonic())
+            if not wait[0]:
+                self.in_flight += 1
+            return wait
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                if self.in_flight >= int(self.window):
+                    start = time.monotonic()
+                    while self.in_flight >= int(self.window):
+                        self.freed.wait()
+                    waited = time.monotonic() - start
+                else:
+                    waited = 0
+                wait_for, reason = self._take_token(time.monotonic())
+                if not wait_for:
+                    self.in_flight += 1
+            if waited:
+                METRICS.slept("concurrency", waited)
+            if not wait_for:
+                return
+            time.sleep(wait_for)
+            METRICS.slept(reason, wait_for)
+
+    def _congested(self, key, seconds):
+        """Fold a latency sample into the endpoint's average; True on a spike."""
+        stats = self.latency.get(key)
+        if stats is None:
+            self.latency[key] = [seconds, seconds]
+            return False
+        stats[0] += LATENCY_SMOOTHING * (seconds - stats[0])
+        # The baseline follows the lowest average, drifting up slowly if the API got slower
+        stats[1] = min(stats[0], stats[1] + 0.01 * (stats[0] - stats[1]))
+        return stats[0] > LATENCY_SPIKE * stats[1]
+
+    def done(self, method, path, seconds, status):
+        with self.lock:
+            self.in_flight -= 1
+            now = time.monotonic()
+            congested = status == 429 or self._congested(f"{method} {_endpoint(path)}", seconds)
+            if congested:
+                if now >= self.calm_after:
+                    self.rate = max(self.min_rate, self.rate * AIMD_BACKOFF)
+                    self.window = max(1.0, self.window * AIMD_BACKOFF)
+                    self.tokens = min(self.tokens, 1.0)
+                    self.calm_after = now + BACKOFF_COOLDOWN
+            elif now >= self.calm_after:
+                if self.tokens < 1:  # callers are waiting on the rate
+                    self.rate = min(self.max_rate, self.rate + AIMD_STEP / self.rate)
+                if self.in_flight + 1 >= int(self.window):  # ... or on the window
+                    self.window = min(self.max_window, self.window + 1 / self.window)
+            self.capacity = max(1.0, self.rate)
+            rate, window = self.rate, self.window
+            self.freed.notify()
+        METRICS.gauge("limiter", rate=rate, window=window)
+
+
+LIMITER = AdaptiveLimiter()
+WORKERS = DEFAULT_WORKERS
+
+
+# ── HTTP Transport ─────────────────────────────────────────────────
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections to one API host, shared across threads.
+
+    Each request checks out an idle connection (or opens a new one) and
+    returns it afterwards, so TCP+TLS handshakes happen once per worker
+    instead of once per call. Idle connections the server has closed are
+    dropped at checkout; a reused connection that still fails is replaced
+    transparently only when the request cannot have reached the server or
+    is safe to repeat (_is_idempotent) -- an append is never sent twice.
+    """
 
-            top_nodes.append(h3_node)
-            processed_until = section_end
+    def __init__(self, base_url, maxsize=16, timeout=60):
+        parts = urllib.parse.urlsplit(base_url)
+        self.base_url = base_url
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "opened": 0, "reused": 0, "closed": 0}
+
+    def _count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def _checkout(self):
+        with self.lock:
+            while self.idle:
+                conn = self.idle.pop()
+                if _dropped(conn.sock):
+                    self.counts["closed"] += 1
+                    conn.close()
+                    continue
+                self.counts["reused"] += 1
+                return conn, True
+            self.counts["opened"] += 1
+        cls = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+        return cls(self.host, self.port, timeout=self.timeout), False
+
+    def _checkin(self, conn):
+        with self.lock:
+            if len(self.idle) < self.maxsize:
+                self.idle.append(conn)
+                return
+            self.counts["closed"] += 1
+        conn.close()
+
+    def _discard(self, conn):
+        self._count("closed")
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """Send one request; returns (status, headers, body bytes)."""
+        self._count("requests")
+        while True:
+            conn, reused = self._checkout()
+            sent = False
+            try:
+                conn.request(method, self.prefix + path, body=body, headers=headers or {})
+                sent = True
+                resp = conn.getresponse()
+                data = resp.read()
+            except (ConnectionError, http.client.RemoteDisconnected, http.client.CannotSendRequest):
+                self._discard(conn)
+                if reused and (not sent or _is_idempotent(method, path)):
+                    continue  # stale keep-alive connection; retry on a fresh one
+                raise
+            except Exception:
+                self._discard(conn)
+                raise
+            if resp.will_close:
+                self._discard(conn)
+            else:
+                self._checkin(conn)
+            return resp.status, resp.headers, data
 
-    # Remaining content after last heading
-    if processed_until < len(lines):
-        top_nodes.extend(parse_lines_to_blocks(lines, processed_until, len(lines)))
+    def stats(self):
+        with self.lock:
+            return dict(self.counts, idle=len(self.idle))
 
-    return top_nodes
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
 
 
-# ── API ────────────────────────────────────────────────────────────
+def _dropped(sock):
+    """True if the server closed (or wrote to) an idle connection's socket."""
+    if sock is None:
+        return True
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (OSError, ValueError):
+        return True
 
-def api_call(method, path, data=None):
+
+POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def get_pool():
+    """Return the shared connection pool for BASE, creating it on first use."""
+    global POOL
     _ensure_init()
-    url = BASE + path
-    body = json.dumps(data).encode() if data else None
-    req = urllib.request.Request(url, data=body, headers=HEADERS, method=method)
+    with _POOL_LOCK:
+        if POOL is None or POOL.base_url != BASE:
+            POOL = ConnectionPool(BASE, maxsize=max(16, WORKERS * 2))
+        return POOL
+
+
+# ── API ────────────────────────────────────────────────────────────
+
+MAX_RETRIES = 5
+RETRY_BACKOFF = 1.0      # seconds, doubled per attempt
+RETRY_BACKOFF_MAX = 30.0
+TRANSIENT_STATUSES = (409, 500, 502, 503, 504)
+
+
+def _is_idempotent(method, path):
+    # Appends are the only non-idempotent call: a 5xx may still have created
+    # the blocks, so only 429s (never processed) are retried for them. File
+    # upload parts can be sent again (the later copy of a part wins).
+    return (method in ("GET", "DELETE") or (method == "PATCH" and not path.endswith("/children"))
+            or (method == "POST" and path.endswith("/send")))
+
+
+def _retry_delay(attempt, retry_after=None):
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+    return min(RETRY_BACKOFF * 2 ** attempt, RETRY_BACKOFF_MAX) * random.uniform(0.5, 1.0)
+
+
+def _timed_request(pool, method, path, body, headers=None):
+    """pool.request, recorded in METRICS (failed attempts as status "error")
+    and reported to LIMITER."""
+    start = time.perf_counter()
+    sent = len(body) if body else 0
+    status, received = "error", 0
     try:
-        with urllib.request.urlopen(req) as resp:
-            return json.loads(resp.read())
-    except urllib.error.HTTPError as e:
-        error = e.read().decode()
-        print(f"  API ERROR {e.code}: {error[:500]}")
-        raise
+        status, headers, raw = pool.request(method, path, body, headers or HEADERS)
+        received = len(raw)
+        return status, headers, raw
+    finally:
+        METRICS.request(method, path, status, start, sent, received)
+        LIMITER.done(method, path, time.perf_counter() - start, status)
+
+
+def _check_response(method, path, status, headers, raw):
+    """Decode a response body, raising HTTPError for error statuses."""
+    if status >= 400:
+        # Same exception type urllib raised before the pooled transport
+        raise urllib.error.HTTPError(BASE + path, status, http.client.responses.get(status, ""),
+                                     headers, io.BytesIO(raw))
+    return json.loads(raw) if raw else {}
+
+
+def _retry_delay_for(method, path, error, attempt, retries):
+    """Seconds to back off before retrying after `error`, or None to give up.
+
+    429s pause the shared LIMITER for their Retry-After instead (delay 0);
+    transient statuses and connection errors are only retried when the
+    request is idempotent.
+    """
+    if attempt >= retries:
+        return None
+    if isinstance(error, urllib.error.HTTPError):
+        if error.code == 429:
+            delay = _retry_delay(attempt, error.headers.get("Retry-After"))
+            LIMITER.pause(delay)
+            METRICS.retry("429")
+            print(f"  API 429 on {method} {path[:40]}, retrying in {delay:.1f}s")
+            return 0
+        if error.code in TRANSIENT_STATUSES and _is_idempotent(method, path):
+            delay = _retry_delay(attempt)
+            print(f"  API {error.code} on {method} {path[:40]}, retrying in {delay:.1f}s")
+            METRICS.retry(str(error.code))
+            return delay
+        return None
+    if _is_idempotent(method, path):
+        delay = _retry_delay(attempt)
+        print(f"  API connection error on {method} {path[:40]} ({error}), retrying in {delay:.1f}s")
+        METRICS.retry("connection")
+        return delay
+    return None
+
+
+def _give_up(error):
+    if isinstance(error, urllib.error.HTTPError):
+        print(f"  API ERROR {error.code}: {error.read().decode()[:500]}")
+
+
+def _encode_form(fields):
+    """multipart/form-data body for {name: text or (filename, bytes, content type)}.
+
+    Returns (body, Content-Type header).
+    """
+    boundary = os.urandom(16).hex()
+    parts = []
+    for name, value in fields.items():
+        if isinstance(value, tuple):
+            filename, content, content_type = value
+            head = (f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                    f"Content-Type: {content_type}")
+        else:
+            head, content = f'Content-Disposition: form-data; name="{name}"', value.encode()
+        parts += [f"--{boundary}\r\n{head}\r\n\r\n".encode(), content, b"\r\n"]
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
 
 
-def clear_page(page_id):
-    """Delete all blocks from a page, keeping child_page and child_database."""
+def api_call(method, path, data=None, retries=MAX_RETRIES, form=None):
+    """Send one API request through the shared rate limiter.
+
+    429 responses are retried after their Retry-After delay (pausing every
+    other caller too); transient 5xx/409 responses and connection errors are
+    retried with exponential backoff for idempotent requests. `form` sends
+    multipart form fields (see _encode_form) instead of a JSON body.
+    """
+    pool = get_pool()
+    request_headers = None
+    if form is not None:
+        body, content_type = _encode_form(form)
+        request_headers = dict(HEADERS, **{"Content-Type": content_type})
+    else:
+        body = json.dumps(data).encode() if data else None
+    for attempt in range(retries + 1):
+        LIMITER.acquire()
+        try:
+            status, headers, raw = _timed_request(pool, method, path, body, request_headers)
+            return _check_response(method, path, status, headers, raw)
+        except (OSError, http.client.HTTPException) as e:
+            delay = _retry_delay_for(method, path, e, attempt, retries)
+            if delay is None:
+                _give_up(e)
+                raise
+            if delay:
+                time.sleep(delay)
+                METRICS.slept("backoff", delay)
+
+
+# Blocks that belong to other pages/databases and are never touched by uploads
+PROTECTED_TYPES = ("child_page", "child_database")
+
+
+def clear_page(page_id, workers=None):
+    """Delete all blocks from a page, keeping child_page and child_database.
+
+    Listing and deleting are pipelined: each page of children is handed to a
+    worker pool while the next page is fetched, and every DELETE goes through
+    api_call's rate limiting and retries. Returns the IDs of blocks that could
+    not be deleted.
+    """
     deleted = skipped = 0
+    failed = []
+    pending = {}  # future -> block_id
+    with ThreadPoolExecutor(max_workers=workers or WORKERS) as pool:
+        start_cursor = None
+        while True:
+            url = f"/blocks/{page_id}/children?page_size=100"
+            if start_cursor:
+                url += f"&start_cursor={start_cursor}"
+            result = api_call("GET", url)
+            for block in result.get("results", []):
+                if block.get("type") in PROTECTED_TYPES:
+                    skipped += 1
+                    continue
+                pending[pool.submit(api_call, "DELETE", f"/blocks/{block['id']}")] = block["id"]
+            if not result.get("has_more"):
+                break
+            start_cursor = result["next_cursor"]
+
+        for future in as_completed(pending):
+            if future.exception() is None:
+                deleted += 1
+            else:
+                failed.append(pending[future])
+    print(f"  Cleared {deleted} blocks (kept {skipped} child pages)")
+    if failed:
+        print(f"  Failed to delete {len(failed)} blocks:")
+        for block_id in failed:
+            print(f"    {block_id}")
+    return failed
+
+
+def delete_blocks(block_ids, workers=None):
+    """Delete blocks (with their children) concurrently, started in the order
+    given. Returns the IDs that could not be deleted."""
+    with ThreadPoolExecutor(max_workers=workers or WORKERS) as pool:
+        pending = {pool.submit(api_call, "DELETE", f"/blocks/{block_id}"): block_id
+                   for block_id in block_ids}
+        return [pending[f] for f in as_completed(pending) if f.exception() is not None]
+
+
+# Append request limits (see references/append-block-children.md)
+MAX_CHILDREN = 100             # per children array
+MAX_NESTING = 2                # levels of children below the appended blocks
+MAX_REQUEST_BLOCKS = 1000      # block elements per request, nested ones included
+MAX_PAYLOAD_BYTES = 450_000    # request body limit is 500 KB; keep some headroom
+
+
+def _subtree_shape(node):
+    """Return (depth, block_count, fits) for a node's subtree.
+
+    Table rows count as a nesting level; `fits` is False once any children
+    array in the subtree exceeds MAX_CHILDREN.
+    """
+    if node.type == "table" and not node.children:
+        rows = len(node.block["table"]["children"])  # ready-made table block
+        return 1, 1 + rows, rows <= MAX_CHILDREN
+    depth, count, fits = 0, 1, len(node.children) <= MAX_CHILDREN
+    for child in node.children:
+        if not child.type:
+            continue
+        d, c, f = _subtree_shape(child)
+        depth = max(depth, d + 1)
+        count += c
+        fits = fits and f
+    return depth, count, fits
+
+
+def _with_children(node):
+    """Block payload with the node's whole subtree embedded (never mutates node.block)."""
+    block = node.block
+    kids = [_with_children(c) for c in node.children if c.type]
+    if not kids:
+        return block
+    btype = block["type"]
+    return {**block, btype: {**block[btype], "children": kids}}
+
+
+def _table_head(node):
+    """Split a table too long for one request into the table with its first
+    rows (as many as one request takes) and the rows left to append."""
+    rows = _child_nodes(node)
+    first = next(pack_children(rows), [])
+    block = node.block
+    return {**block, "table": {**block["table"], "children": [b for b, _ in first]}}, rows[len(first):]
+
+
+def pack_children(nodes):
+    """Pack sibling nodes into append requests, embedding children inline.
+
+    Yields batches as they fill up, so blocks are built one request ahead;
+    each batch is a list of (block, deferred) where `deferred` lists the
+    child nodes that still need their own upload once the block ID is known
+    (subtree too deep or too large to inline, rows of a long table), else None.
+    """
+    batch, batch_blocks, batch_bytes = [], 0, 0
+    for node in nodes:
+        if not node.type:
+            continue
+        depth, count, fits = _subtree_shape(node)
+        item = None
+        if fits and depth <= MAX_NESTING and count <= MAX_REQUEST_BLOCKS:
+            block = _with_children(node)
+            size = len(json.dumps(block))
+            if size <= MAX_PAYLOAD_BYTES:
+                item = (block, None)
+        if item is None:
+            if node.type == "table":
+                block, rest = _table_head(node)
+            else:
+                block, rest = node.block, [c for c in node.children if c.type]
+            count, size = _count_blocks(block), len(json.dumps(block))
+            item = (block, rest or None)
+        if batch and (len(batch) >= MAX_CHILDREN
+                      or batch_blocks + count > MAX_REQUEST_BLOCKS
+                      or batch_bytes + size > MAX_PAYLOAD_BYTES):
+            yield batch
+            batch, batch_blocks, batch_bytes = [], 0, 0
+        batch.append(item)
+        batch_blocks += count
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+def _position(after):
+    """Build the append `position` payload for an anchor ("start" or a block ID)."""
+    if after == "start":
+        return {"type": "start"}
+    return {"type": "after_block", "after_block": {"id": after}}
+
+
+def _title(block):
+    btype = block["type"]
+    rt = block[btype].get("rich_text") or []
+    return rt[0].get("text", {}).get("content", "?") if rt else "?"
+
+
+def _count_blocks(block):
+    btype = block["type"]
+    return 1 + sum(_count_blocks(c) for c in block[btype].get("children", []))
+
+
+# ── Upload Plan ────────────────────────────────────────────────────
+
+def compile_plan(parent_id, nodes, after=None, depth=0):
+    """Compile a Node tree into a JSON-serializable list of append operations.
+
+    Each op appends `children` (packed blocks, see pack_children) to `parent`:
+    a block ID, or {"op": k, "index": i} for the i-th block created by op k.
+    Ops into the same parent run in order (`prev`); `defer` lists the blocks
+    whose children follow in ops of their own. `after` positions the first op
+    and, for later ops, points at the last block created by `prev`.
+    """
+    ops = []
+
+    def add_chain(parent, nodes, after, depth):
+        prev = None
+        for batch in pack_children(nodes):
+            k = len(ops)
+            op = {"parent": parent, "depth": depth,
+                  "children": [block for block, _ in batch],
+                  "defer": [i for i, (_, rest) in enumerate(batch) if rest is not None]}
+            if prev is not None:
+                op["prev"] = prev
+            if after:
+                op["after"] = after if prev is None else {"op": prev, "index": -1}
+            ops.append(op)
+            for i, (_, rest) in enumerate(batch):
+                if rest is not None:
+                    add_chain({"op": k, "index": i}, rest, None, depth + 1)
+            prev = k
+
+    add_chain(parent_id, nodes, after, depth)
+    return ops
+
+
+def _dependency(op):
+    """The op that must finish before this one can be sent (or None)."""
+    if "prev" in op:
+        return op["prev"]
+    if isinstance(op["parent"], dict):
+        return op["parent"]["op"]
+    return None
+
+
+def _resolve(ref, ids):
+    """Turn a plan reference into a block ID using the IDs created so far."""
+    if isinstance(ref, dict):
+        return ids[ref["op"]][ref["index"]]
+    return ref
+
+
+def plan_ids(ops, ids):
+    """IDs of the top-level blocks a finished plan created, in order."""
+    return [bid for k, op in enumerate(ops) if not isinstance(op["parent"], dict)
+            for bid in ids.get(k, [])]
+
+
+JOURNAL_DIR = os.path.join(".claude", "cache", "notion")
+
+
+def journal_path(page_id):
+    return os.path.join(JOURNAL_DIR, f"upload-{page_id.replace('-', '')}.jsonl")
+
+
+class Journal:
+    """Append-only JSON-lines record of an upload plan and its progress.
+
+    The first line holds the plan; then `cleared` once the page was emptied,
+    `sent` before each op goes out and `ack` with the created block IDs once
+    it succeeded. Every line is flushed to disk before the upload moves on,
+    so an interrupted run can be resumed from the last acknowledged op.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def start(self, page_id, ops):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "w", encoding="utf-8")
+        self.write({"page_id": page_id, "ops": ops})
+
+    def write(self, record):
+        self.file.write(json.dumps(record, separators=(",", ":")) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def load(self):
+        """Reopen an existing journal; returns (page_id, ops, cleared, sent, acked)."""
+        cleared, sent, acked = False, set(), {}
+        with open(self.path, encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break  # torn final line from the interrupted run
+                if record.get("cleared"):
+                    cleared = True
+                elif "sent" in record:
+                    sent.add(record["sent"])
+                elif "ack" in record:
+                    acked[record["ack"]] = record["ids"]
+        self.file = open(self.path, "a", encoding="utf-8")
+        return header["page_id"], header["ops"], cleared, sent, acked
+
+    def close(self, remove=False):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if remove:
+            os.remove(self.path)
+
+
+# ── Upload Scheduler ───────────────────────────────────────────────
+
+class UploadScheduler:
+    """Execute a compiled upload plan as a dependency graph of requests.
+
+    Ops into one parent run in order; ops into different parents only depend
+    on their parent existing, so they run concurrently on a worker pool.
+    Every request still passes the shared LIMITER, and the op with the most
+    blocks left behind it goes first so the largest subtree never ends up as
+    a long sequential tail. With a Journal, every op is recorded as sent and
+    acknowledged.
+    """
+
+    def __init__(self, workers=None, journal=None):
+        self.workers = workers or WORKERS
+        self.journal = journal
+        self.ready = []  # heap of (-remaining, k)
+        self.ids = {}    # op index -> created IDs, also after a failed run
+
+    @staticmethod
+    def _payload(op, ids):
+        payload = {"children": op["children"]}
+        if op.get("after"):
+            payload["position"] = _position(_resolve(op["after"], ids))
+        return f"/blocks/{_resolve(op['parent'], ids)}/children", payload
+
+    @classmethod
+    def _send(cls, op, ids):
+        return api_call("PATCH", *cls._payload(op, ids))
+
+    @classmethod
+    async def _send_async(cls, op, ids):
+        return await api_call_async("PATCH", *cls._payload(op, ids))
+
+    def _prepare(self, ops, done):
+        """Index dependents and weights; queue the ops that can start right away."""
+        ids = self.ids = dict(done or {})
+        dependents = [[] for _ in ops]
+        for k, op in enumerate(ops):
+            dep = _dependency(op)
+            if dep is not None:
+                dependents[dep].append(k)
+        # Blocks still to send once an op is ready: its own plus everything after it
+        weights = [0] * len(ops)
+        for k in reversed(range(len(ops))):
+            weights[k] = (sum(_count_blocks(b) for b in ops[k]["children"])
+                          + sum(weights[d] for d in dependents[k]))
+        for k, op in enumerate(ops):
+            dep = _dependency(op)
+            if k not in ids and (dep is None or dep in ids):
+                heapq.heappush(self.ready, (-weights[k], k))
+        return ids, dependents, weights
+
+    def _dispatch(self):
+        """Pop the heaviest ready op, journaling that it is about to be sent."""
+        _, k = heapq.heappop(self.ready)
+        if self.journal:
+            self.journal.write({"sent": k})
+        return k
+
+    def _finish(self, ops, k, result, ids, dependents, weights):
+        ids[k] = [block["id"] for block in result.get("results", [])]
+        if self.journal:
+            self.journal.write({"ack": k, "ids": ids[k]})
+        self._complete(ops, k, ids)
+        for d in dependents[k]:
+            heapq.heappush(self.ready, (-weights[d], d))
+
+    def run(self, ops, done=None):
+        """Run every op not in done ({op index: created IDs}); returns all IDs."""
+        _ensure_init()
+        ids, dependents, weights = self._prepare(ops, done)
+        running = {}  # future -> op index
+        error = None
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while self.ready or running:
+                while self.ready and len(running) < self.workers and error is None:
+                    k = self._dispatch()
+                    running[pool.submit(self._send, ops[k], ids)] = k
+                if not running:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    k = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        error = error or e
+                        continue
+                    self._finish(ops, k, result, ids, dependents, weights)
+        if error is not None:
+            raise error
+        return ids
+
+    async def run_async(self, ops, done=None):
+        """run() on the event loop: ops are tasks, calls go through api_call_async.
+
+        Cancelling the caller cancels the requests in flight; with a Journal,
+        what was acknowledged so far can be resumed.
+        """
+        _ensure_init()
+        ids, dependents, weights = self._prepare(ops, done)
+        running = {}  # task -> op index
+        error = None
+        try:
+            while self.ready or running:
+                while self.ready and len(running) < self.workers and error is None:
+                    k = self._dispatch()
+                    running[asyncio.ensure_future(self._send_async(ops[k], ids))] = k
+                if not running:
+                    break
+                finished, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                for task in finished:
+                    k = running.pop(task)
+                    if task.exception() is not None:
+                        error = error or task.exception()
+                        continue
+                    self._finish(ops, k, task.result(), ids, dependents, weights)
+        finally:
+            for task in running:
+                task.cancel()
+            if running:
+                await asyncio.gather(*running, return_exceptions=True)
+        if error is not None:
+            raise error
+        return ids
+
+    @staticmethod
+    def _complete(ops, k, ids):
+        op = ops[k]
+        prefix = "  " * op["depth"]
+        parent = _resolve(op["parent"], ids)
+        print(f"{prefix}Uploaded {sum(_count_blocks(b) for b in op['children'])} blocks "
+              f"to {parent[:12]}... (op {k + 1}/{len(ops)})")
+        for i in op["defer"]:
+            block = op["children"][i]
+            print(f"{prefix}  → {block['type']}: {_title(block)[:50]}...")
+
+
+def upload_nodes(parent_id, nodes, depth=0, after=None, workers=None):
+    """Upload nodes with their children packed inline where the API allows it.
+
+    Subtrees that are too deep or too large for one request are uploaded
+    afterwards into the returned block IDs, concurrently across parents (see
+    compile_plan and UploadScheduler). With `after` ("start" or a block ID)
+    the nodes are inserted at that position instead of appended. Returns the
+    IDs of the created top-level blocks.
+    """
+    ops = compile_plan(parent_id, nodes, after, depth)
+    return plan_ids(ops, UploadScheduler(workers).run(ops))
+
+
+# ── Sync (diff against the remote page) ────────────────────────────
+
+# Block types whose content can be changed in place via PATCH /blocks/{id}
+UPDATABLE_TYPES = (
+    "paragraph", "heading_1", "heading_2", "heading_3", "bulleted_list_item",
+    "numbered_list_item", "to_do", "quote", "code", "table_row",
+)
+
+
+def list_children(block_id):
+    """Return all child blocks of a block, following pagination cursors."""
+    blocks = []
     start_cursor = None
     while True:
-        url = f"/blocks/{page_id}/children?page_size=100"
+        url = f"/blocks/{block_id}/children?page_size=100"
         if start_cursor:
             url += f"&start_cursor={start_cursor}"
         result = api_call("GET", url)
-        for block in result.get("results", []):
-            if block.get("type") in ("child_page", "child_database"):
-                skipped += 1
-                continue
-            try:
-                api_call("DELETE", f"/blocks/{block['id']}")
-                deleted += 1
-            except Exception:
-                pass
+        blocks.extend(result.get("results", []))
         if not result.get("has_more"):
-            break
+            return blocks
         start_cursor = result["next_cursor"]
-    print(f"  Cleared {deleted} blocks (kept {skipped} child pages)")
 
 
-def upload_nodes(parent_id, nodes, depth=0):
-    """Upload nodes, then recursively upload children into headings."""
-    prefix = "  " * depth
-    top_blocks = [n.block for n in nodes if n.block]
-    toggle_map = []  # (index_in_batch, node)
+def _rich_text_key(rich_text):
+    """Normalize a request- or response-shaped rich_text array for comparison.
 
-    for i, node in enumerate(nodes):
-        if node.children and node.block and node.block["type"].startswith("heading_"):
-            toggle_map.append((i, node))
+    Responses carry every annotation (mostly False), plain_text and hrefs, and
+    may split text differently — so only content, link and active styles count.
+    """
+    parts = []
+    for seg in rich_text:
+        ann = seg.get("annotations") or {}
+        style = tuple(sorted(k for k, v in ann.items() if v is True))
+        color = ann.get("color", "default")
+        if seg.get("type") == "mention":
+            target = seg.get("mention", {}).get("page", {}).get("id", "")
+            parts.append(("mention", target.replace("-", ""), style, color))
+            continue
+        text = seg.get("text", {})
+        link = (text.get("link") or {}).get("url")
+        content = text.get("content", "")
+        if parts and parts[-1][0] == "text" and parts[-1][2:] == (link, style, color):
+            parts[-1] = ("text", parts[-1][1] + content, link, style, color)
+        elif content:
+            parts.append(("text", content, link, style, color))
+    return parts
+
+
+def _media_source(data):
+    """What a media block shows, comparable between requests and responses.
+
+    That is the URL of an external file, else the name of the uploaded file:
+    responses only carry a hosted URL ending in that name, and requests a
+    file upload ID whose name UPLOADS knows. Upload names embed the content
+    hash (see send_file), so a changed file has a different key.
+    """
+    kind = data.get("type")
+    if kind == "external":
+        return data["external"].get("url")
+    if kind == "file":
+        url_path = urllib.parse.urlsplit(data["file"].get("url", "")).path
+        return urllib.parse.unquote(posixpath.basename(url_path))
+    if kind == "file_upload":
+        upload_id = data["file_upload"]["id"]
+        return UPLOADS.name_of(upload_id) or upload_id
+    return None
+
+
+def block_key(block):
+    """Content signature of a single block (children excluded)."""
+    btype = block.get("type")
+    data = block.get(btype) or {}
+    key = [btype]
+    if btype == "code":
+        key.append("".join(s.get("text", {}).get("content", "") for s in data.get("rich_text", [])))
+    elif "rich_text" in data:
+        key.append(_rich_text_key(data["rich_text"]))
+    elif btype in MEDIA_TYPES:
+        key += [_rich_text_key(data.get("caption", [])), _media_source(data)]
+    if btype == "table_row":
+        key.append([_rich_text_key(cell) for cell in data.get("cells", [])])
+    for field in ("is_toggleable", "checked", "language",
+                  "table_width", "has_column_header", "has_row_header"):
+        if field in data:
+            key.append((field, data[field]))
+    return key
+
+
+def block_hash(block):
+    return hashlib.sha1(json.dumps(block_key(block), sort_keys=True).encode()).hexdigest()
+
+
+def _child_nodes(node):
+    """Children of a node as they appear remotely (table rows are real children)."""
+    if node.type == "table" and not node.children:
+        return [Node(row) for row in node.block["table"].get("children", [])]
+    return node.children
+
+
+def hash_tree(nodes):
+    """[(node, subtree hash, hash tree of its children)] for a list of nodes."""
+    tree = []
+    for node in nodes:
+        children = hash_tree(_child_nodes(node))
+        digest = hashlib.sha1(block_hash(node.block).encode())
+        for _, child_hash, _ in children:
+            digest.update(child_hash.encode())
+        tree.append((node, digest.hexdigest(), children))
+    return tree
+
+
+def tree_hash(tree):
+    """Content hash of a whole hash_tree (e.g. everything published to a page)."""
+    return hashlib.sha1("".join(h for _, h, _ in tree).encode()).hexdigest()
+
+
+def _source_key(node):
+    """What a node's block is built from: factory and arguments, or the ready-made block."""
+    if node.build is None:
+        return block_key(node.args)
+    args = node.args
+    if node.build is mk_media and len(args) > 3:
+        args = args[:3] + (UPLOADS.name_of(args[3]) or args[3],)  # the file's content, not its upload
+    return [node.type, node.build.__name__, args]
+
+
+def nodes_hash(nodes):
+    """Content hash of parsed nodes, as stored in PUBLISHED and IMPORTED.
+
+    Computed from the source of each block (_source_key) rather than its
+    payload, so checking for an unchanged page builds nothing; the blocks
+    are built once, by compile_plan or sync, when the page is published.
+    A change to the block factories themselves goes unnoticed (use force).
+    """
+    digest = hashlib.sha1()
 
-    if not top_blocks:
-        return
+    def feed(nodes):
+        for node in nodes:
+            digest.update(json.dumps(_source_key(node), ensure_ascii=False).encode())
+            digest.update(b"{")
+            feed(node.children)
+            digest.update(b"}")
 
-    # Upload in batches of 100
-    all_results = []
-    for batch_start in range(0, len(top_blocks), 100):
-        batch = top_blocks[batch_start:batch_start + 100]
-        result = api_call("PATCH", f"/blocks/{parent_id}/children", {"children": batch})
-        all_results.extend(result.get("results", []))
-        if batch_start > 0:
-            time.sleep(0.3)
-
-    print(f"{prefix}Uploaded {len(top_blocks)} blocks to {parent_id[:12]}...")
-
-    # Upload heading children
-    for orig_idx, node in toggle_map:
-        if orig_idx < len(all_results):
-            heading_id = all_results[orig_idx]["id"]
-            htype = node.block["type"]
-            rt = node.block[htype]["rich_text"]
-            title = rt[0].get("text", {}).get("content", "?") if rt else "?"
-            print(f"{prefix}  → {htype}: {title[:50]}...")
-            upload_nodes(heading_id, node.children, depth + 1)
-            time.sleep(0.15)
+    feed(nodes)
+    return digest.hexdigest()
 
 
-# ── Main ───────────────────────────────────────────────────────────
+def _update_payload(block):
+    btype = block["type"]
+    return {btype: {k: v for k, v in block[btype].items() if k != "children"}}
+
+
+def sync_children(parent_id, nodes, stats, depth=0):
+    """Make the children of parent_id match nodes, touching only what changed.
+
+    Remote and local blocks are aligned by content hash (difflib opcodes keep
+    their order); matched blocks recurse into their children, same-type
+    mismatches are updated in place, everything else is deleted or inserted.
+    """
+    remote = []
+    anchor = "start"
+    for block in list_children(parent_id):
+        if block.get("type") in PROTECTED_TYPES:
+            if not remote:
+                anchor = block["id"]  # keep new content below leading child pages
+            continue
+        remote.append(block)
+    local = [n for n in nodes if n.type]
+
+    matcher = difflib.SequenceMatcher(
+        None, [block_hash(b) for b in remote], [block_hash(n.block) for n in local],
+        autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for block, node in zip(remote[i1:i2], local[j1:j2]):
+                _sync_subtree(block, node, stats, depth)
+                anchor = block["id"]
+            stats["unchanged"] += i2 - i1
+            continue
+
+        paired = 0
+        if tag == "replace":
+            for block, node in zip(remote[i1:i2], local[j1:j2]):
+                if block["type"] != node.type or block["type"] not in UPDATABLE_TYPES:
+                    break
+                api_call("PATCH", f"/blocks/{block['id']}", _update_payload(node.block))
+                stats["updated"] += 1
+                _sync_subtree(block, node, stats, depth)
+                anchor = block["id"]
+                paired += 1
+
+        for block in remote[i1 + paired:i2]:
+            api_call("DELETE", f"/blocks/{block['id']}")
+            stats["deleted"] += 1
+
+        inserted = local[j1 + paired:j2]
+        if inserted:
+            created = upload_nodes(parent_id, inserted, depth, after=anchor)
+            stats["inserted"] += len(inserted)
+            if created:
+                anchor = created[-1]
+
+
+def _sync_subtree(block, node, stats, depth):
+    children = _child_nodes(node)
+    if children or block.get("has_children"):
+        sync_children(block["id"], children, stats, depth + 1)
+
+
+# ── Publish Cache ──────────────────────────────────────────────────
+
+class PublishCache:
+    """What each page got from its last successful publish.
+
+    Maps page ID → content hash of the published tree and the page's
+    last_edited_time right after the publish. If both still match, the
+    page needs no work; a newer last_edited_time means someone edited the
+    page in Notion since. Stored as one JSON file, re-read before every
+    write (a --watch process and a batch run may share it) and replaced
+    atomically.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = None
+        self.lock = threading.Lock()
+
+    def _load(self, reload=False):
+        if self.entries is None or reload:
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.entries = json.load(f)
+            except (FileNotFoundError, ValueError):
+                self.entries = {}
+        return self.entries
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.path)
+
+    def get(self, page_id):
+        with self.lock:
+            return self._load().get(page_id)
+
+    def put(self, page_id, content_hash, last_edited_time):
+        self.put_many({page_id: (content_hash, last_edited_time)})
+
+    def put_many(self, entries):
+        """put() for {page ID: (content hash, last_edited_time)}, written once."""
+        if not entries:
+            return
+        with self.lock:
+            loaded = self._load(reload=True)
+            for page_id, (content_hash, last_edited_time) in entries.items():
+                loaded[page_id] = {"hash": content_hash, "last_edited_time": last_edited_time}
+            self._save()
+
+    def forget(self, page_id):
+        with self.lock:
+            if self._load(reload=True).pop(page_id, None) is not None:
+                self._save()
 
-def upload_file(filepath, page_id, title, link_map=None, append=False):
+
+PUBLISHED = PublishCache(os.path.join(JOURNAL_DIR, "published.json"))
+
+
+def last_edited_time(page_id):
+    return api_call("GET", f"/pages/{page_id}").get("last_edited_time")
+
+
+def _is_published(page_id, content_hash, edited):
+    """Whether the page still holds content_hash, per PUBLISHED and its last_edited_time.
+
+    Warns when the page was edited in Notion since the last publish.
+    """
+    entry = PUBLISHED.get(page_id)
+    if edited != entry["last_edited_time"]:
+        print(f"  Warning: page {page_id} was edited in Notion since the last publish "
+              f"({entry['last_edited_time']} → {edited}); those edits will be overwritten")
+        return False
+    return entry["hash"] == content_hash
+
+
+# ── Media (local files → file uploads) ─────────────────────────────
+
+MEDIA_SINGLE_PART_MAX = 20 * 1024 * 1024  # larger files are sent in parts (API limit: 20 MB)
+MEDIA_PART_SIZE = 10 * 1024 * 1024        # per part; the API takes 5–20 MB (the last may be smaller)
+MEDIA_PARTS_IN_FLIGHT = 4                 # parts of one file read into memory and sent at once
+MEDIA_EXPIRY_MARGIN = timedelta(minutes=10)  # reuse an unattached upload only this long before expiry
+
+
+class FileUploadCache(PublishCache):
+    """Content hash → the file upload holding that content.
+
+    Entries are {"id", "name", "expiry_time"}: the upload ID, the file name
+    it was sent under and when it expires if not attached to a block (None
+    once it is known to be attached; it can then be reused indefinitely).
+    Stored and shared like PublishCache.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self.names = {}  # upload ID -> name, for block_key
+
+    def _load(self, reload=False):
+        if self.entries is None or reload:
+            super()._load(reload=True)
+            self.names = {entry["id"]: entry["name"] for entry in self.entries.values()}
+        return self.entries
+
+    def put_upload(self, digest, entry):
+        with self.lock:
+            self._load(reload=True)[digest] = entry
+            self.names[entry["id"]] = entry["name"]
+            self._save()
+
+    def name_of(self, upload_id):
+        with self.lock:
+            self._load()
+            return self.names.get(upload_id)
+
+
+UPLOADS = FileUploadCache(os.path.join(JOURNAL_DIR, "uploads.json"))
+_DIGESTS = {}    # (path, mtime, size) -> sha256 of the file
+_UPLOADING = {}  # sha256 -> Future of its upload ID, for this run
+_UPLOADING_LOCK = threading.Lock()
+
+
+def local_media(nodes, base_dir=""):
+    """[(node, path)] for the media nodes below nodes that reference local
+    files; paths are relative to base_dir (the markdown file's directory)."""
+    found = []
+    for node in nodes:
+        if node.type in MEDIA_TYPES and node.build is mk_media and "://" not in node.args[1]:
+            found.append((node, os.path.normpath(os.path.join(base_dir, node.args[1]))))
+        found += local_media(node.children, base_dir)
+    return found
+
+
+def file_digest(path):
+    """sha256 of a file, computed once per version of the file."""
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_mtime_ns, st.st_size)
+    digest = _DIGESTS.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        digest = _DIGESTS[key] = sha.hexdigest()
+    return digest
+
+
+def _attachable(entry):
+    expiry = entry["expiry_time"]
+    return expiry is None or (datetime.fromisoformat(expiry)
+                              > datetime.now(timezone.utc) + MEDIA_EXPIRY_MARGIN)
+
+
+def _cached_upload(digest):
+    """The UPLOADS entry for digest if its upload can still be attached, else None.
+
+    Entries from an earlier run that were not known to be attached, and
+    whose expiry has passed, are looked up once: attached uploads come back
+    without an expiry_time and are reusable from then on.
+    """
+    entry = UPLOADS.get(digest)
+    if entry is None or _attachable(entry):
+        return entry
+    try:
+        upload = api_call("GET", f"/file_uploads/{entry['id']}")
+    except urllib.error.HTTPError as e:
+        if e.code in (400, 404):
+            return None  # another workspace or integration: upload again
+        raise
+    if upload.get("status") != "uploaded":
+        return None
+    entry = dict(entry, expiry_time=upload.get("expiry_time"))
+    UPLOADS.put_upload(digest, entry)
+    return entry if _attachable(entry) else None
+
+
+def send_file(path, digest):
+    """Upload a local file through the file upload API; returns its UPLOADS entry.
+
+    Files up to MEDIA_SINGLE_PART_MAX are sent in one request. Larger ones
+    are split into MEDIA_PART_SIZE parts, sent MEDIA_PARTS_IN_FLIGHT at a
+    time (each through LIMITER), then completed. The upload is named after
+    the file plus its content hash, which is what block_key compares.
+    """
+    stem, ext = os.path.splitext(os.path.basename(path))
+    name = f"{re.sub(r'[^A-Za-z0-9._-]+', '_', stem)[:80]}-{digest[:12]}{ext}"
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    size = os.path.getsize(path)
+    if size <= MEDIA_SINGLE_PART_MAX:
+        upload = api_call("POST", "/file_uploads", {"filename": name, "content_type": content_type})
+        with open(path, "rb") as f:
+            upload = api_call("POST", f"/file_uploads/{upload['id']}/send",
+                              form={"file": (name, f.read(), content_type)})
+    else:
+        parts = -(-size // MEDIA_PART_SIZE)
+        upload = api_call("POST", "/file_uploads", {
+            "mode": "multi_part", "number_of_parts": parts,
+            "filename": name, "content_type": content_type})
+
+        def send_part(number):
+            with open(path, "rb") as f:
+                f.seek((number - 1) * MEDIA_PART_SIZE)
+                chunk = f.read(MEDIA_PART_SIZE)
+            api_call("POST", f"/file_uploads/{upload['id']}/send",
+                     form={"file": (name, chunk, content_type), "part_number": str(number)})
+
+        with ThreadPoolExecutor(max_workers=min(MEDIA_PARTS_IN_FLIGHT, parts)) as pool:
+            list(pool.map(send_part, range(1, parts + 1)))
+        upload = api_call("POST", f"/file_uploads/{upload['id']}/complete")
+    if upload.get("status") != "uploaded":
+        raise RuntimeError(f"file upload {upload['id']} is {upload.get('status')!r}, not 'uploaded'")
+    return {"id": upload["id"], "name": name, "expiry_time": upload.get("expiry_time")}
+
+
+def file_upload_id(path):
+    """(file upload ID, whether it was sent now) for a local file.
+
+    Content already uploaded in this run, by any thread, or cached in
+    UPLOADS from an earlier one is reused by ID instead of sent again.
+    """
+    digest = file_digest(path)
+    with _UPLOADING_LOCK:
+        future = _UPLOADING.get(digest)
+        owner = future is None
+        if owner:
+            future = _UPLOADING[digest] = Future()
+    if not owner:
+        return future.result(), False
+    try:
+        entry = _cached_upload(digest)
+        sent = entry is None
+        if sent:
+            entry = send_file(path, digest)
+            UPLOADS.put_upload(digest, entry)
+    except BaseException as e:
+        with _UPLOADING_LOCK:
+            del _UPLOADING[digest]  # let a later call try again
+        future.set_exception(e)
+        raise
+    future.set_result(entry["id"])
+    return entry["id"], sent
+
+
+def upload_media(media, workers=None):
+    """Upload the files of local media nodes and point the nodes at them.
+
+    `media` is [(node, path)] as returned by local_media (possibly for many
+    pages at once). Distinct files are uploaded concurrently; each content
+    is sent once (see file_upload_id). A file that cannot be uploaded is
+    reported and its nodes stay unresolved; publishing checks for them
+    (check_media) before writing, so the page or row using it fails
+    untouched. Returns the number of files sent.
+    """
+    nodes_by_path = {}
+    for node, path in media:
+        nodes_by_path.setdefault(path, []).append(node)
+    if not nodes_by_path:
+        return 0
+    start = time.perf_counter()
+    sent = failed = 0
+    with ThreadPoolExecutor(max_workers=min(workers or WORKERS, len(nodes_by_path))) as pool:
+        futures = {pool.submit(file_upload_id, path): path for path in nodes_by_path}
+        for future in as_completed(futures):
+            path = futures[future]
+            if future.exception() is not None:
+                print(f"  FAILED: {path}: {future.exception()}")
+                failed += 1
+                continue
+            upload_id, was_sent = future.result()
+            sent += was_sent
+            for node in nodes_by_path[path]:
+                node.args = node.args[:3] + (upload_id,)
+    METRICS.phase("media", start, files=len(nodes_by_path))
+    print(f"Media: {len(nodes_by_path)} files, {sent} uploaded, "
+          f"{len(nodes_by_path) - sent - failed} reused" + (f", {failed} failed" if failed else ""))
+    return sent
+
+
+class MediaError(RuntimeError):
+    """Local media of a page could not be uploaded (raised before writing the page)."""
+
+
+def check_media(nodes):
+    """Raise MediaError if upload_media left local media below nodes unresolved."""
+    missing = [path for node, path in local_media(nodes) if len(node.args) < 4]
+    if missing:
+        raise MediaError(f"{len(missing)} local files could not be uploaded: {', '.join(missing)}")
+
+
+def plan_media(media):
+    """Point local media nodes at placeholder upload IDs (`upload:<path>`),
+    so a plan can be written without uploading anything."""
+    for node, path in media:
+        node.args = node.args[:3] + (f"upload:{path}",)
+
+
+# ── Upload ─────────────────────────────────────────────────────────
+
+def _print_connection_stats():
+    if POOL is not None:
+        st = POOL.stats()
+        print(f"Connections: {st['opened']} opened, {st['reused']} reused "
+              f"for {st['requests']} requests")
+
+
+STREAM_BUFFER = 16  # parsed top-level sections queued ahead of the uploader
+
+
+def _parse_in_background(filepath, link_map, buffer):
+    """Parse a file on a thread, queueing finished sections (None = done)."""
+    def run():
+        try:
+            parse_time = 0.0
+            with open(filepath, encoding="utf-8") as f:
+                sections = iter_markdown(f, link_map)
+                while True:
+                    start = time.perf_counter()
+                    node = next(sections, None)
+                    parse_time += time.perf_counter() - start
+                    if node is None:
+                        break
+                    buffer.put(node)
+            METRICS.parsed(filepath, parse_time)
+            buffer.put(None)
+        except BaseException as e:
+            buffer.put(e)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def upload_stream(filepath, page_id, link_map=None, clear=False):
+    """Upload a file section by section while the rest is still being parsed.
+
+    A parser thread feeds completed top-level sections into a bounded queue;
+    whatever has queued up is uploaded as one group, so network I/O overlaps
+    with parsing and memory is bounded by a few sections. With clear, the
+    page is cleared once the first group's media is uploaded. A group whose
+    media failed stops the upload before it is written (MediaError). Returns
+    the number of top-level blocks uploaded.
+    """
+    buffer = queue.Queue(maxsize=STREAM_BUFFER)
+    _parse_in_background(filepath, link_map, buffer)
+    base_dir = os.path.dirname(filepath)
+    total = 0
+    done = False
+    while not done:
+        group = [buffer.get()]
+        while not buffer.empty() and len(group) < MAX_CHILDREN:
+            group.append(buffer.get())
+        if group[-1] is None or isinstance(group[-1], BaseException):
+            done = True
+            end = group.pop()
+            if end is not None:
+                raise end
+        if group:
+            upload_media(local_media(group, base_dir))
+            try:
+                check_media(group)
+            except MediaError as e:
+                if total:
+                    raise MediaError(f"{e}; stopped after the first {total} top-level "
+                                     f"blocks") from None
+                raise
+            if clear:
+                clear = False
+                failed = clear_page(page_id)
+                if failed:
+                    raise RuntimeError(f"{len(failed)} old blocks could not be deleted; not "
+                                       f"uploading on top of them (re-run or use --sync)")
+            upload_nodes(page_id, group)
+            total += len(group)
+    return total
+
+
+def upload_file(filepath, page_id, title, link_map=None, append=False, sync=False,
+                stream=False, resume=False, plan=None, force=False, blue_green=False):
     print(f"\n{'='*60}")
-    print(f"{'Appending' if append else 'Uploading'}: {title}")
+    action = ("Resuming" if resume else "Appending" if append else "Syncing" if sync
+              else "Uploading (blue-green)" if blue_green else "Uploading")
+    print(f"{action}: {title}")
     print(f"Source: {filepath}")
     print(f"Page: {page_id}")
     print(f"{'='*60}")
 
+    if resume:
+        resume_upload(page_id)
+        print(f"Done: {title}")
+        _print_connection_stats()
+        return
+
+    if stream:
+        if sync:
+            raise ValueError("sync needs the whole document; it cannot be streamed")
+        PUBLISHED.forget(page_id)
+        count = upload_stream(filepath, page_id, link_map, clear=not append)
+        print(f"Streamed: {count} top-level blocks")
+        print(f"Done: {title}")
+        _print_connection_stats()
+        return
+
     with open(filepath, encoding="utf-8") as f:
         lines = f.readlines()
 
+    start = time.perf_counter()
     nodes = parse_markdown(lines, link_map)
+    METRICS.parsed(filepath, time.perf_counter() - start)
+    METRICS.phase("parse", start, file=filepath)
     print(f"Parsed: {len(nodes)} top-level blocks")
+    media = local_media(nodes, os.path.dirname(filepath))
+    if plan:
+        plan_media(media)
+        ops = compile_plan(page_id, nodes)
+        with open(plan, "w", encoding="utf-8") as f:
+            json.dump({"page_id": page_id, "ops": ops}, f, ensure_ascii=False, indent=1)
+        print(f"Plan: {len(ops)} requests written to {plan}")
+        return
+    upload_media(media)
+    if not publish_nodes(page_id, nodes, append=append, sync=sync, force=force,
+                         blue_green=blue_green):
+        print("Unchanged since the last publish (use --force to publish anyway)")
+    print(f"Done: {title}")
+    _print_connection_stats()
+
+
+def publish_nodes(page_id, nodes, append=False, sync=False, force=False, blue_green=False):
+    """Replace (or append to, or sync) a page's content with parsed nodes.
+
+    Uploads are compiled into a plan and journaled (see Journal), so an
+    interrupted run can be finished with resume_upload. With blue_green the
+    old content stays up until the new one is complete (see
+    publish_blue_green). Unless force is set, a page whose content and
+    last_edited_time match PUBLISHED is left alone after one GET. Returns
+    whether the page was written. Raises MediaError before writing anything
+    if local media below nodes was not uploaded.
+    """
+    check_media(nodes)
+    content_hash = None if append else nodes_hash(nodes)
+    if content_hash and not force and PUBLISHED.get(page_id):
+        if _is_published(page_id, content_hash, last_edited_time(page_id)):
+            return False
+    PUBLISHED.forget(page_id)
+    if blue_green:
+        publish_blue_green(page_id, nodes)
+    else:
+        _write_nodes(page_id, nodes, append, sync)
+    if content_hash:
+        PUBLISHED.put(page_id, content_hash, last_edited_time(page_id))
+    return True
+
+
+def _write_nodes(page_id, nodes, append, sync):
+    if sync:
+        start = time.perf_counter()
+        stats = {"unchanged": 0, "updated": 0, "deleted": 0, "inserted": 0}
+        sync_children(page_id, nodes, stats)
+        METRICS.phase("sync", start, page=page_id)
+        print(f"Synced: {stats['updated']} updated, {stats['inserted']} inserted, "
+              f"{stats['deleted']} deleted, {stats['unchanged']} unchanged")
+        return
+
+    ops = compile_plan(page_id, nodes)
+    journal = Journal(journal_path(page_id))
+    journal.start(page_id, ops)
+    if not append:
+        start = time.perf_counter()
+        failed = clear_page(page_id)
+        METRICS.phase("clear", start, page=page_id)
+        if failed:
+            journal.close(remove=True)
+            raise RuntimeError(f"{len(failed)} old blocks could not be deleted; not uploading "
+                               f"on top of them (re-run or use --sync)")
+    journal.write({"cleared": True})
+    _run_journaled(journal, ops, {})
+
+
+def publish_blue_green(page_id, nodes, workers=None):
+    """Replace a page's content without clearing it before the new one exists.
+
+    The API cannot move blocks, so the new version is built below the old
+    one (visible there while it runs), then verified: every request
+    acknowledged with all of its blocks, and the page listing exactly the
+    old blocks followed by the new ones. Only then are the old top-level
+    blocks deleted, one request each, bottom up with the first one last, so
+    the top of the page keeps showing the old version until the swap ends.
+    A failed or interrupted build deletes what it created and leaves the
+    old content as it was.
+    """
+    old = [b["id"] for b in list_children(page_id) if b.get("type") not in PROTECTED_TYPES]
+    ops = compile_plan(page_id, nodes)
+    scheduler = UploadScheduler(workers)
+    start = time.perf_counter()
+    try:
+        ids = scheduler.run(ops)
+        new = plan_ids(ops, ids)
+        _verify_build(page_id, ops, ids, old, new)
+    except BaseException:
+        created = plan_ids(ops, scheduler.ids)
+        failed = delete_blocks(created, workers)
+        print(f"  Build failed; removed {len(created) - len(failed)} new blocks, "
+              f"old content untouched")
+        for block_id in failed:
+            print(f"    not removed: {block_id}")
+        raise
+    METRICS.phase("upload", start, requests=len(ops))
+    print(f"  Built {len(new)} top-level blocks below the old content (verified)")
+
+    start = time.perf_counter()
+    failed = delete_blocks(old[:0:-1], workers) + delete_blocks(old[:1], workers)
+    METRICS.phase("swap", start, page=page_id)
+    print(f"  Swapped: removed {len(old) - len(failed)} old blocks "
+          f"in {time.perf_counter() - start:.2f}s")
+    if failed:
+        raise RuntimeError(f"{len(failed)} old blocks could not be deleted: "
+                           f"{', '.join(failed)} (re-run or use --sync)")
+
+
+def _verify_build(page_id, ops, ids, old, new):
+    """Raise RuntimeError unless the plan created every block and the page is old + new."""
+    for k, op in enumerate(ops):
+        if len(ids.get(k, ())) != len(op["children"]):
+            raise RuntimeError(f"request {k + 1}/{len(ops)} created {len(ids.get(k, ()))} "
+                               f"of {len(op['children'])} blocks")
+    remote = [b["id"] for b in list_children(page_id) if b.get("type") not in PROTECTED_TYPES]
+    if remote != old + new:
+        raise RuntimeError(f"{page_id} changed while the new content was uploaded")
+
+
+def _run_journaled(journal, ops, done):
+    start = time.perf_counter()
+    try:
+        UploadScheduler(journal=journal).run(ops, done)
+    except BaseException:
+        journal.close()
+        print(f"Upload interrupted; progress saved to {journal.path} (continue with --resume)")
+        raise
+    journal.close(remove=True)
+    METRICS.phase("upload", start, requests=len(ops) - len(done))
+
+
+def _reconcile(ops, in_flight, ids):
+    """Find out which ops that were in flight when a run died did reach Notion.
+
+    Appends are atomic and ops into one parent run in order, so an op that
+    went through left its blocks right behind the previous op's last block
+    (or, in a parent created by the plan, behind the children it was
+    created with, e.g. the first rows of a long table). Returns {op: IDs}.
+    """
+    adopted = {}
+    for k in sorted(in_flight):
+        op = ops[k]
+        n = len(op["children"])
+        remote = [b for b in list_children(_resolve(op["parent"], ids))
+                  if b.get("type") not in PROTECTED_TYPES]
+        remote_ids = [b["id"] for b in remote]
+        if "prev" in op:
+            start = remote_ids.index(ids[op["prev"]][-1]) + 1
+        elif isinstance(op["parent"], dict):
+            parent = ops[op["parent"]["op"]]["children"][op["parent"]["index"]]
+            start = len(parent[parent["type"]].get("children") or ())
+        else:
+            start = max(len(remote) - n, 0)  # first op into the page: nothing came after it
+        found = remote[start:start + n]
+        if len(found) == n and [block_hash(b) for b in found] == [block_hash(b) for b in op["children"]]:
+            adopted[k] = [b["id"] for b in found]
+        elif found and (isinstance(op["parent"], dict) or "prev" in op):
+            raise RuntimeError(f"{_resolve(op['parent'], ids)} changed since the interrupted "
+                               f"upload; re-run without --resume")
+    return adopted
+
+
+def resume_upload(page_id):
+    """Finish an interrupted upload from its journal."""
+    journal = Journal(journal_path(page_id))
+    if not os.path.exists(journal.path):
+        raise FileNotFoundError(f"No interrupted upload for {page_id} ({journal.path})")
+    PUBLISHED.forget(page_id)
+    _, ops, cleared, sent, ids = journal.load()
+    if not cleared:
+        # Interrupted while clearing: nothing of the plan was sent yet
+        failed = clear_page(page_id)
+        if failed:
+            journal.close()
+            raise RuntimeError(f"{len(failed)} old blocks could not be deleted; not uploading "
+                               f"on top of them (re-run or use --sync)")
+        journal.write({"cleared": True})
+    for k, created in _reconcile(ops, sent - ids.keys(), ids).items():
+        journal.write({"ack": k, "ids": created})
+        ids[k] = created
+    print(f"Resuming: {len(ids)} of {len(ops)} requests already done")
+    _run_journaled(journal, ops, ids)
+
+
+# ── Directory Publish ──────────────────────────────────────────────
+
+def map_directory(directory, pages):
+    """Match the markdown files below directory to config page entries.
+
+    A file belongs to the page whose key equals its file name without .md,
+    or whose entry names it explicitly ({"id": ..., "file": "guide/setup.md"}).
+    Returns {relative posix path: page ID}; unmatched files are reported.
+    """
+    by_file = {}
+    by_stem = {}
+    for key, entry in pages.items():
+        if isinstance(entry, dict) and entry.get("file"):
+            by_file[posixpath.normpath(entry["file"])] = page_id_of(entry)
+        by_stem[key] = page_id_of(entry)
+
+    mapping = {}
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if not name.endswith(".md"):
+                continue
+            rel = os.path.relpath(os.path.join(root, name), directory).replace(os.sep, "/")
+            page_id = by_file.get(rel) or by_stem.get(name[:-3])
+            if page_id:
+                mapping[rel] = page_id
+            else:
+                print(f"  Skipping {rel}: no page in config")
+    return mapping
+
+
+def _parse_file(path, link_map, base, deep_headings):
+    """Process-pool worker: parse one file with links resolved from its directory.
+
+    Returns the nodes and the time spent parsing (for METRICS).
+    """
+    start = time.perf_counter()
+    with open(path, encoding="utf-8") as f:
+        nodes = parse_markdown(f, LinkResolver(link_map, base), deep_headings)
+    return nodes, time.perf_counter() - start
+
+
+def publish_dir(directory, pages, append=False, sync=False, force=False, blue_green=False):
+    """Publish every mapped markdown file below directory to its page.
+
+    Links between the files become page mentions automatically. Files are
+    parsed in parallel on a process pool (as lazy nodes: payloads are built
+    here, per page, by compile_plan), then pages are uploaded concurrently;
+    all requests share one connection pool and rate limiter.
+    Pages unchanged since their last publish are skipped (see PUBLISHED).
+    """
+    mapping = map_directory(directory, pages)
+    print(f"Publishing {len(mapping)} files from {directory}")
+    if not mapping:
+        return
+
+    parsed = {}
+    start = time.perf_counter()
+    with ProcessPoolExecutor() as procs:
+        futures = {
+            procs.submit(_parse_file, os.path.join(directory, rel), mapping,
+                         posixpath.dirname(rel), DEEP_HEADINGS): rel
+            for rel in mapping
+        }
+        for future in as_completed(futures):
+            rel = futures[future]
+            parsed[rel], seconds = future.result()
+            METRICS.parsed(rel, seconds)
+    METRICS.phase("parse", start, files=len(parsed))
+    print(f"Parsed: {sum(len(n) for n in parsed.values())} top-level blocks in {len(parsed)} files")
+
+    _ensure_init()
+    upload_media([m for rel, nodes in parsed.items()
+                  for m in local_media(nodes, os.path.join(directory, posixpath.dirname(rel)))])
+    failed = []
+    skipped = 0
+    with ThreadPoolExecutor(max_workers=min(WORKERS, len(mapping))) as pages_pool:
+        futures = {
+            pages_pool.submit(publish_nodes, mapping[rel], parsed[rel], append, sync, force,
+                              blue_green): rel
+            for rel in sorted(mapping)
+        }
+        for future in as_completed(futures):
+            rel = futures[future]
+            if future.exception() is None:
+                if future.result():
+                    print(f"Done: {rel}")
+                else:
+                    print(f"Unchanged: {rel}")
+                    skipped += 1
+            else:
+                print(f"FAILED: {rel}: {future.exception()}")
+                failed.append(rel)
+    if skipped:
+        print(f"Skipped {skipped} of {len(mapping)} pages unchanged since the last publish")
+    _print_connection_stats()
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(mapping)} pages failed: {', '.join(sorted(failed))}")
+
+
+# ── Export (Notion → markdown) ─────────────────────────────────────
+
+def fetch_tree(root_id, workers=None):
+    """Fetch every block below root_id; returns {block ID: [child blocks]}.
+
+    Breadth-first and concurrent: each block with children is queued as soon
+    as its parent's list arrives, on a worker pool behind the shared LIMITER.
+    Child pages and databases are not descended into.
+    """
+    tree = {}
+    with ThreadPoolExecutor(max_workers=workers or WORKERS) as pool:
+        pending = {pool.submit(list_children, root_id): root_id}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                parent = pending.pop(future)
+                tree[parent] = future.result()
+                for block in tree[parent]:
+                    if block.get("has_children") and block.get("type") not in PROTECTED_TYPES:
+                        pending[pool.submit(list_children, block["id"])] = block["id"]
+    return tree
+
+
+def render_rich_text(rich_text):
+    """Render a rich_text array in the inline syntax parse_rich_text reads.
+
+    Adjacent segments with the same style are merged first (long text comes
+    back split). Only bold, italic, code, links and page mentions survive.
+    """
+    runs = []
+    for seg in rich_text:
+        if seg.get("type") == "mention":
+            page = seg.get("mention", {}).get("page")
+            if page:
+                label = (seg.get("plain_text") or "page").replace("]", "")
+                runs.append(("mention", f"[{label}](notion://{page['id']})", None))
+                continue
+        ann = seg.get("annotations") or {}
+        text = seg.get("text")
+        content = text["content"] if text else seg.get("plain_text", "")
+        link = ((text or {}).get("link") or {}).get("url")
+        style = ("code",) if ann.get("code") else tuple(k for k in ("bold", "italic") if ann.get(k))
+        if runs and runs[-1][0] == "text" and runs[-1][2] == (style, link):
+            runs[-1] = ("text", runs[-1][1] + content, (style, link))
+        else:
+            runs.append(("text", content, (style, link)))
+
+    out = []
+    for kind, content, key in runs:
+        if kind == "mention" or not content:
+            out.append(content)
+            continue
+        style, link = key
+        if link:
+            out.append(f"[{content}]({link})")
+        elif style == ("code",):
+            out.append(f"`{content}`")
+        elif style == ("bold", "italic"):
+            out.append(f"***{content}***")
+        elif style == ("bold",):
+            out.append(f"**{content}**")
+        elif style == ("italic",):
+            out.append(f"*{content}*")
+        else:
+            out.append(content)
+    return "".join(out)
+
+
+def _render_blocks(tree, blocks, out, depth=0, heading=0):
+    """Append markdown for blocks to out; headings nest their children by level."""
+    indent = "  " * depth
+    for block in blocks:
+        btype = block.get("type")
+        data = block.get(btype) or {}
+        kids = tree.get(block["id"], []) if block.get("has_children") else []
+        text = render_rich_text(data.get("rich_text", []))
+
+        if btype in ("heading_1", "heading_2", "heading_3"):
+            # A heading inside a heading of the same or lower rank came from H4+ (nest)
+            level = max(int(btype[-1]), heading + 1)
+            out.append(f"{'#' * level} {text}\n\n")
+            _render_blocks(tree, kids, out, depth, level)
+            continue
+        if btype in PROTECTED_TYPES:
+            continue
+        if btype == "code":
+            lang = data.get("language", "plain text")
+            content = "".join(s.get("text", {}).get("content", s.get("plain_text", ""))
+                              for s in data.get("rich_text", []))
+            lines = [f"```{'' if lang == 'plain text' else lang}", *content.split("\n"), "```"]
+        elif btype == "table":
+            lines = []
+            for i, row in enumerate(kids):
+                cells = [render_rich_text(c) for c in row.get("table_row", {}).get("cells", [])]
+                lines.append("| " + " | ".join(cells) + " |")
+                if i == 0:
+                    lines.append("|" + "---|" * len(cells))
+            kids = []
+        elif btype == "quote":
+            lines = [f"> {line}" if line else ">" for line in text.split("\n")]
+        elif btype == "divider":
+            lines = ["---"]
+        elif btype == "bulleted_list_item":
+            lines = [f"- {text}"]
+        elif btype == "numbered_list_item":
+            lines = [f"1. {text}"]
+        elif btype == "to_do":
+            lines = [f"- [{'x' if data.get('checked') else ' '}] {text}"]
+        elif text:
+            lines = [text]  # paragraphs, and the text of callouts, toggles etc.
+        else:
+            continue
+        out.extend(f"{indent}{line}\n" for line in lines)
+        if kids:
+            _render_blocks(tree, kids, out, depth + 1, heading)
+        if depth == 0:
+            out.append("\n")
+
+
+def page_title(page_id):
+    page = api_call("GET", f"/pages/{page_id}")
+    for prop in page.get("properties", {}).values():
+        if prop.get("type") == "title":
+            return "".join(s.get("plain_text", "") for s in prop["title"])
+    return "Untitled"
+
+
+def export_page(page_id, title=None, workers=None):
+    """Export a page as markdown that parse_markdown reads back into the same tree.
+
+    The title becomes the leading H1 (which the parser drops again). Content
+    the dialect cannot express (colors, child pages, images...) is left out.
+    """
+    _ensure_init()
+    if title is None:
+        title = page_title(page_id)
+    tree = fetch_tree(page_id, workers)
+    out = [f"# {title}\n\n"]
+    _render_blocks(tree, tree[page_id], out)
+    return "".join(out).rstrip("\n") + "\n"
+
+
+# ── Watch (re-publish on save) ─────────────────────────────────────
+
+WATCH_INTERVAL = 0.5   # seconds between mtime polls
+WATCH_DEBOUNCE = 1.0   # quiet time after the last save before publishing
+
+
+class WatchedPage:
+    """A markdown file and its page, with the tree last published to it.
+
+    After the first publish the parsed tree (with a content hash per
+    subtree) stays in memory, and so do the block IDs of every child list
+    that has been needed once. A save is diffed against that instead of the
+    remote page: unchanged subtrees cost nothing, and only the branches
+    that changed are updated in place, inserted or deleted. Edits made in
+    Notion are not looked for; when one gets in the way (a block to update
+    or anchor on is gone), that save falls back to a full sync.
+    """
+
+    def __init__(self, path, page_id, link_map=None):
+        self.path = path
+        self.page_id = page_id
+        self.link_map = link_map
+        self.mtime = self.stat()
+        self.tree = None  # hash tree of the last publish
+        self.ids = {}     # block ID → IDs of its (non-protected) children
+        self.heads = {}   # block ID → anchor for inserts at the start
+
+    def stat(self):
+        """Modification time of the file, or None while it is missing (atomic saves)."""
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def parse(self):
+        start = time.perf_counter()
+        with open(self.path, encoding="utf-8") as f:
+            nodes = [n for n in parse_markdown(f, self.link_map) if n.type]
+        METRICS.parsed(self.path, time.perf_counter() - start)
+        upload_media(local_media(nodes, os.path.dirname(self.path)))
+        return nodes
+
+    def publish(self):
+        """Bring the page up to date with the file; returns the sync stats."""
+        nodes = self.parse()
+        check_media(nodes)
+        tree = hash_tree(nodes)
+        content_hash = nodes_hash(nodes)
+        stats = {"unchanged": 0, "updated": 0, "deleted": 0, "inserted": 0}
+        if self.tree is None and PUBLISHED.get(self.page_id):
+            if _is_published(self.page_id, content_hash, last_edited_time(self.page_id)):
+                self.tree = tree  # child IDs are listed when first needed
+        if self.tree is not None and tree_hash(self.tree) == tree_hash(tree):
+            stats["unchanged"] = len(tree)
+            return stats
+
+        PUBLISHED.forget(self.page_id)
+        try:
+            if self.tree is not None:
+                self._patch(self.page_id, self.tree, tree, 0, stats)
+                self.tree = tree
+        except (urllib.error.HTTPError, RuntimeError) as e:
+            print(f"  {self.path}: page changed in Notion ({e}), re-syncing")
+            stats = dict.fromkeys(stats, 0)
+            self.tree = None
+        if self.tree is None:
+            self.ids.clear()
+            self.heads.clear()
+            start = time.perf_counter()
+            sync_children(self.page_id, nodes, stats)
+            METRICS.phase("sync", start, page=self.page_id)
+            self.tree = tree
+        PUBLISHED.put(self.page_id, content_hash, last_edited_time(self.page_id))
+        return stats
+
+    def _child_ids(self, parent_id, count):
+        """IDs of parent_id's children, listed once and then kept up to date."""
+        ids = self.ids.get(parent_id)
+        if ids is None:
+            ids = []
+            head = "start"
+            for block in list_children(parent_id):
+                if block.get("type") in PROTECTED_TYPES:
+                    if not ids:
+                        head = block["id"]  # keep new content below leading child pages
+                    continue
+                ids.append(block["id"])
+            self.heads[parent_id] = head
+        if len(ids) != count:
+            raise RuntimeError(f"{parent_id} has {len(ids)} blocks, expected {count}")
+        return ids
+
+    def _patch(self, parent_id, old, new, depth, stats):
+        """Turn parent_id's children from hash tree `old` into `new`.
+
+        Replacement blocks are inserted before the blocks they replace are
+        deleted, so readers never see a gap.
+        """
+        ids = self._child_ids(parent_id, len(old)) if old else self.ids.get(parent_id, [])
+        matcher = difflib.SequenceMatcher(
+            None, [h for _, h, _ in old], [h for _, h, _ in new], autojunk=False)
+        kept = []
+        stale = []
+        anchor = self.heads.get(parent_id, "start")
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+            if tag == "equal":
+                kept.extend(ids[i1:i2])
+                anchor = ids[i2 - 1]
+                stats["unchanged"] += i2 - i1
+                continue
+
+            paired = 0
+            if tag == "replace":
+                for (was, _, was_children), (node, _, children), block_id in zip(
+                        old[i1:i2], new[j1:j2], ids[i1:i2]):
+                    if was.type != node.type or node.type not in UPDATABLE_TYPES:
+                        break
+                    if block_hash(was.block) != block_hash(node.block):
+                        api_call("PATCH", f"/blocks/{block_id}", _update_payload(node.block))
+                        stats["updated"] += 1
+                    if was_children or children:
+                        self._patch(block_id, was_children, children, depth + 1, stats)
+                    kept.append(block_id)
+                    anchor = block_id
+                    paired += 1
+
+            inserted = [node for node, _, _ in new[j1 + paired:j2]]
+            if inserted:
+                created = upload_nodes(parent_id, inserted, depth, after=anchor)
+                kept.extend(created)
+                stats["inserted"] += len(inserted)
+                anchor = created[-1]
+            stale.extend(ids[i1 + paired:i2])
+
+        for block_id in stale:
+            api_call("DELETE", f"/blocks/{block_id}")
+            self.ids.pop(block_id, None)
+            stats["deleted"] += 1
+        self.ids[parent_id] = kept
+
+
+def _publish_watched(page):
+    start = time.perf_counter()
+    try:
+        stats = page.publish()
+    except Exception as e:
+        page.tree = None  # unknown remote state: sync in full next time
+        print(f"FAILED: {page.path}: {e}")
+        return
+    changes = stats["updated"] + stats["inserted"] + stats["deleted"]
+    print(f"{time.strftime('%H:%M:%S')} {page.path}: "
+          + (f"{stats['updated']} updated, {stats['inserted']} inserted, "
+             f"{stats['deleted']} deleted" if changes else "no changes")
+          + f" ({time.perf_counter() - start:.1f}s)")
+
+
+def watch(pages, interval=WATCH_INTERVAL, debounce=WATCH_DEBOUNCE):
+    """Publish WatchedPages now and again after every save, until interrupted.
+
+    The process stays resident, so config, connection pool and the last
+    published trees are reused between saves. Files are polled every
+    `interval` seconds; a file is published once it has been quiet for
+    `debounce` seconds, so an editor's burst of writes costs one publish.
+    """
+    _ensure_init()
+    if not pages:
+        return
+    print(f"Watching {len(pages)} files (Ctrl-C to stop)")
+    with ThreadPoolExecutor(max_workers=min(WORKERS, len(pages))) as pool:
+        list(pool.map(_publish_watched, pages))
+        changed = {}
+        while True:
+            time.sleep(interval)
+            now = time.monotonic()
+            for page in pages:
+                mtime = page.stat()
+                if mtime is not None and mtime != page.mtime:
+                    page.mtime = mtime
+                    changed[page] = now
+            ready = [page for page, saved in changed.items() if now - saved >= debounce]
+            for page in ready:
+                del changed[page]
+            if ready:
+                list(pool.map(_publish_watched, ready))
+                _print_connection_stats()
+
+
+# ── Import (records → data source pages) ───────────────────────────
+
+IMPORT_BODY_FIELD = "body"  # CSV column with the page body as markdown (unless it is a property)
+WRITABLE_TYPES = ("title", "rich_text", "number", "select", "multi_select", "status", "date",
+                  "checkbox", "url", "email", "phone_number", "people", "relation")
+KEY_TYPES = ("title", "rich_text", "number", "select", "status", "url", "email", "phone_number")
+TRUE_VALUES = ("true", "yes", "y", "1", "x", "✓", "checked")
+
+
+def _front_matter_scalar(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] and text[0] in "'\"":
+        return text[1:-1]
+    return text
+
+
+def parse_front_matter(lines):
+    """Split `---`-delimited front matter off the top of a markdown file.
+
+    Understands the YAML subset record metadata uses: `key: value`, quoted
+    values, inline lists `[a, b]` and `- item` lines below a `key:`. Returns
+    (fields, index of the first body line); values are strings or lists.
+    """
+    if not lines or lines[0].strip() != "---":
+        return {}, 0
+    fields = {}
+    key = None
+    for i, line in enumerate(lines[1:], 1):
+        stripped = line.strip()
+        if stripped == "---":
+            return fields, i + 1
+        if not stripped or stripped.startswith("#"):
+            continue
+        if stripped.startswith("- ") and isinstance(fields.get(key), list):
+            fields[key].append(_front_matter_scalar(stripped[2:]))
+            continue
+        name, sep, value = line.partition(":")
+        if not sep:
+            raise ValueError(f"front matter line {i + 1}: expected 'key: value'")
+        key = name.strip()
+        value = value.strip()
+        if not value:
+            fields[key] = []  # a `- item` list may follow
+        elif value.startswith("[") and value.endswith("]"):
+            inner = value[1:-1]
+            fields[key] = [_front_matter_scalar(v) for v in
+                           next(csv.reader([inner], skipinitialspace=True))] if inner.strip() else []
+        else:
+            fields[key] = _front_matter_scalar(value)
+    raise ValueError("front matter is not closed with ---")
+
+
+def read_csv_records(path):
+    """One record per CSV row: {"source", "fields", "body" (None), "stem"}."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return [{"source": f"{os.path.basename(path)}:{line}", "fields": row, "body": None, "stem": None}
+                for line, row in enumerate(csv.DictReader(f), 2)]
+
+
+def read_markdown_records(directory):
+    """One record per .md file below directory: front matter as fields, the rest as body."""
+    records = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if not d.startswith("."))
+        for name in sorted(files):
+            if not name.endswith(".md"):
+                continue
+            path = os.path.join(root, name)
+            with open(path, encoding="utf-8") as f:
+                lines = f.readlines()
+            rel = os.path.relpath(path, directory).replace(os.sep, "/")
+            try:
+                fields, start = parse_front_matter(lines)
+            except ValueError as e:
+                raise ValueError(f"{rel}: {e}") from None
+            records.append({"source": rel, "fields": fields, "body": lines[start:], "stem": name[:-3]})
+    return records
+
+
+def _number(text):
+    try:
+        return int(text)
+    except ValueError:
+        try:
+            return float(text)
+        except ValueError:
+            raise ValueError(f"{text!r} is not a number") from None
+
+
+def property_value(ptype, value):
+    """Request-shaped value of a `ptype` property from a CSV cell or front-matter value.
+
+    Lists come from front matter; in CSV cells, multi-value properties are
+    comma-separated. Empty values clear the property.
+    """
+    if isinstance(value, list):
+        items, text = [str(v).strip() for v in value if str(v).strip()], ", ".join(map(str, value))
+    else:
+        text = "" if value is None else str(value).strip()
+        items = [v.strip() for v in text.split(",") if v.strip()]
+    if ptype in ("title", "rich_text"):
+        return {ptype: parse_rich_text(text) if text else []}
+    if ptype == "number":
+        return {"number": _number(text) if text else None}
+    if ptype in ("select", "status"):
+        return {ptype: {"name": text} if text else None}
+    if ptype == "multi_select":
+        return {"multi_select": [{"name": v} for v in items]}
+    if ptype == "date":
+        start, _, end = text.partition("/")  # ISO 8601 interval: start/end
+        return {"date": {"start": start, "end": end or None} if text else None}
+    if ptype == "checkbox":
+        return {"checkbox": text.lower() in TRUE_VALUES}
+    if ptype in ("url", "email", "phone_number"):
+        return {ptype: text or None}
+    if ptype in ("people", "relation"):
+        return {ptype: [{"id": v} for v in items]}
+    raise ValueError(f"{ptype} properties cannot be imported")  # not in WRITABLE_TYPES
+
+
+def property_text(prop):
+    """Plain text of a response-shaped page property, for matching keys."""
+    ptype = prop.get("type")
+    data = prop.get(ptype)
+    if ptype in ("title", "rich_text"):
+        return "".join(seg.get("plain_text", "") for seg in data or [])
+    if ptype in ("select", "status"):
+        return (data or {}).get("name", "")
+    if ptype == "number":
+        return "" if data is None else str(data)
+    return data if isinstance(data, str) else ""
+
+
+def _request_text(ptype, value):
+    """property_text of what a request-shaped property value will store."""
+    data = value[ptype]
+    if ptype in ("title", "rich_text"):
+        return "".join(seg["text"]["content"] for seg in data if seg["type"] == "text")
+    if ptype in ("select", "status"):
+        return (data or {}).get("name", "")
+    if ptype == "number":
+        return "" if data is None else str(data)
+    return data or ""
+
+
+def query_data_source(ds_id):
+    """All pages of a data source, following pagination cursors."""
+    pages = []
+    body = {"page_size": 100}
+    while True:
+        result = api_call("POST", f"/data_sources/{ds_id}/query", body)
+        pages.extend(result.get("results", []))
+        if not result.get("has_more"):
+            return pages
+        body = {"page_size": 100, "start_cursor": result["next_cursor"]}
+
+
+IMPORTED = PublishCache(os.path.join(JOURNAL_DIR, "imported.json"))
+
+
+class ImportRow:
+    """One record resolved against the schema: properties, body nodes, key."""
+
+    __slots__ = ("source", "properties", "nodes", "key")
+
+    def __init__(self, source, properties, nodes, key):
+        self.source = source
+        self.properties = properties
+        self.nodes = nodes
+        self.key = key
+
+    def hashes(self):
+        """[properties hash, body hash], as stored in IMPORTED."""
+        props = json.dumps(self.properties, sort_keys=True, ensure_ascii=False)
+        return [hashlib.sha1(props.encode()).hexdigest(), nodes_hash(self.nodes)]
+
+
+def prepare_rows(records, schema, key=None, columns=None, body_field=IMPORT_BODY_FIELD):
+    """Resolve records against a data source schema.
+
+    Fields map to properties through `columns` ({field: property}), else by
+    name ignoring case; a CSV `body_field` that is not a property becomes
+    the page body. Markdown records without a title field take the first
+    H1 of their body, else the file name. Returns (rows, failures) with
+    failures as (source, message).
+    """
+    by_name = {name.lower(): name for name in schema}
+    title = next((name for name, p in schema.items() if p["type"] == "title"), None)
+    if key and key not in schema:
+        raise ValueError(f"--key {key!r} is not a property of the data source")
+    if key and schema[key]["type"] not in KEY_TYPES:
+        raise ValueError(f"--key {key!r} is a {schema[key]['type']} property; "
+                         f"keys must be one of: {', '.join(KEY_TYPES)}")
+    ignored, unsupported = set(), set()
+    rows, failures, seen = [], [], {}
+    for record in records:
+        fields = dict(record["fields"])
+        body = record["body"]
+        if body is None:
+            field = next((f for f in fields if f and f.lower() == body_field.lower()
+                          and f.lower() not in by_name and f not in (columns or {})), None)
+            body = (fields.pop(field) or "").splitlines(keepends=True) if field else []
+        properties = {}
+        try:
+            for field, value in fields.items():
+                name = (columns or {}).get(field) or by_name.get((field or "").lower())
+                if name is None or name not in schema:
+                    ignored.add(field)
+                    continue
+                ptype = schema[name]["type"]
+                if ptype not in WRITABLE_TYPES:
+                    unsupported.add(name)
+                    continue
+                try:
+                    properties[name] = property_value(ptype, value)
+                except ValueError as e:
+                    raise ValueError(f"{name}: {e}") from None
+            if title and title not in properties:
+                heading = next((line[2:].strip() for line in body if line.startswith("# ")), None)
+                properties[title] = property_value("title", heading or record["stem"] or "")
+            key_text = None
+            if key:
+                if key not in properties:
+                    raise ValueError(f"no value for the key property {key!r}")
+                key_text = _request_text(schema[key]["type"], properties[key])
+                if not key_text:
+                    raise ValueError(f"empty key {key!r}")
+                if key_text in seen:
+                    raise ValueError(f"duplicate key {key_text!r} (also in {seen[key_text]})")
+                seen[key_text] = record["source"]
+            nodes = parse_markdown(body) if body else []
+        except ValueError as e:
+            failures.append((record["source"], str(e)))
+            continue
+        rows.append(ImportRow(record["source"], properties, nodes, key_text))
+    if ignored:
+        print(f"  Ignoring fields with no matching property: {', '.join(sorted(map(str, ignored)))}")
+    if unsupported:
+        print(f"  Not importing read-only or unsupported properties: {', '.join(sorted(unsupported))}")
+    return rows, failures
+
+
+def _create_page(ds_id, row):
+    """Create a row's page; a body that fits one request is sent along with it."""
+    parent = {"type": "data_source_id", "data_source_id": ds_id}
+    ops = compile_plan(ds_id, row.nodes)
+    if len(ops) <= 1 and not any(op["defer"] for op in ops):
+        body = {"parent": parent, "properties": row.properties}
+        if ops:
+            body["children"] = ops[0]["children"]
+        return api_call("POST", "/pages", body)
+    page = api_call("POST", "/pages", {"parent": parent, "properties": row.properties})
+    upload_nodes(page["id"], row.nodes)
+    return api_call("GET", f"/pages/{page['id']}")
+
+
+def _import_row(ds_id, row, page):
+    """Create or update one row's page.
+
+    An existing page is skipped when IMPORTED holds the row's hashes and
+    its last_edited_time is unchanged. Otherwise the body is synced (only
+    changed blocks are sent) if it differs, and the properties are written
+    last, so that response carries the final last_edited_time. Returns
+    ("created" | "updated" | "unchanged", the page after the write, hashes).
+    """
+    hashes = row.hashes()
+    if page is None:
+        return "created", _create_page(ds_id, row), hashes
+    entry = IMPORTED.get(page["id"])
+    known = entry["hash"] if entry and entry["last_edited_time"] == page.get("last_edited_time") else None
+    if known == hashes:
+        return "unchanged", page, hashes
+    if not known or known[1] != hashes[1]:
+        stats = {"unchanged": 0, "updated": 0, "deleted": 0, "inserted": 0}
+        sync_children(page["id"], row.nodes, stats)
+    page = api_call("PATCH", f"/pages/{page['id']}", {"properties": row.properties})
+    return "updated", page, hashes
+
+
+def import_rows(ds_id, rows, key=None, workers=None):
+    """Write prepared rows to a data source concurrently; returns counts and failures.
+
+    With `key` (a property name), rows whose key matches an existing page
+    update that page instead of creating a new one (upsert). Every request
+    goes through api_call, so all pages share LIMITER and the connection
+    pool.
+    """
+    existing = {}
+    if key:
+        pages = query_data_source(ds_id)
+        for page in pages:
+            existing.setdefault(property_text(page["properties"].get(key, {})), page)
+        print(f"  {len(existing)} existing pages by {key!r}")
+        if len(pages) > len(existing):
+            print(f"  Warning: {len(pages) - len(existing)} pages share their {key!r} with an "
+                  f"earlier one; only the first of each is updated")
+    counts = {"created": 0, "updated": 0, "unchanged": 0}
+    failures = []
+    written = {}  # page ID -> (hashes, last_edited_time), saved to IMPORTED in one write
+    try:
+        with ThreadPoolExecutor(max_workers=workers or WORKERS) as pool:
+            futures = {pool.submit(_import_row, ds_id, row, existing.get(row.key) if key else None): row
+                       for row in rows}
+            for n, future in enumerate(as_completed(futures), 1):
+                row = futures[future]
+                if future.exception() is None:
+                    action, page, hashes = future.result()
+                    counts[action] += 1
+                    if action != "unchanged":
+                        written[page["id"]] = (hashes, page.get("last_edited_time"))
+                else:
+                    print(f"FAILED: {row.source}: {future.exception()}")
+                    failures.append((row.source, str(future.exception())))
+                if n % 100 == 0:
+                    print(f"  {n}/{len(rows)} rows")
+    finally:
+        IMPORTED.put_many(written)
+    return counts, failures
+
+
+def import_source(source, ds_id, key=None, columns=None, body_field=IMPORT_BODY_FIELD):
+    """Import a CSV file or a directory of front-matter markdown files into a data source."""
+    print(f"\n{'='*60}")
+    print(f"Importing: {source}")
+    print(f"Data source: {ds_id}")
+    print(f"{'='*60}")
+    start = time.perf_counter()
+    records = read_markdown_records(source) if os.path.isdir(source) else read_csv_records(source)
+    schema = api_call("GET", f"/data_sources/{ds_id}")["properties"]
+    rows, failures = prepare_rows(records, schema, key, columns, body_field)
+    METRICS.phase("parse", start, records=len(records))
+    for where, message in failures:
+        print(f"FAILED: {where}: {message}")
+    print(f"Parsed: {len(rows)} of {len(records)} records")
+    # Bodies reference files relative to the CSV, or to their own markdown file
+    base_dir = source if os.path.isdir(source) else os.path.dirname(source)
+    upload_media([m for row in rows
+                  for m in local_media(row.nodes, os.path.join(base_dir, posixpath.dirname(row.source)))])
+    ready = []
+    for row in rows:
+        try:
+            check_media(row.nodes)
+            ready.append(row)
+        except MediaError as e:
+            print(f"FAILED: {row.source}: {e}")
+            failures.append((row.source, str(e)))
+    rows = ready
+
+    start = time.perf_counter()
+    counts, write_failures = import_rows(ds_id, rows, key)
+    METRICS.phase("import", start, rows=len(rows))
+    failures += write_failures
+    print(f"Imported {len(records)} records: {counts['created']} created, {counts['updated']} updated, "
+          f"{counts['unchanged']} unchanged, {len(failures)} failed")
+    _print_connection_stats()
+    if failures:
+        raise RuntimeError(f"{len(failures)} of {len(records)} records failed")
+
+
+# ── Async Engine ───────────────────────────────────────────────────
+
+ASYNC_CONCURRENCY = 16  # requests in flight per event loop, across all pages
 
+
+class AsyncConnectionPool:
+    """Keep-alive HTTP/1.1 connections over asyncio streams (stdlib only).
+
+    The asyncio counterpart of ConnectionPool: a semaphore bounds the
+    requests in flight, idle connections are reused, and a failing reused
+    connection is replaced under the same rules (never replaying an append
+    the server may have received). Bound to the running loop.
+    """
+
+    def __init__(self, base_url, maxsize=ASYNC_CONCURRENCY, timeout=60):
+        parts = urllib.parse.urlsplit(base_url)
+        self.base_url = base_url
+        self.host = parts.hostname
+        self.port = parts.port or (443 if parts.scheme == "https" else 80)
+        self.host_header = parts.netloc
+        self.ssl = ssl.create_default_context() if parts.scheme == "https" else None
+        self.prefix = parts.path.rstrip("/")
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.slots = asyncio.Semaphore(maxsize)
+        self.loop = asyncio.get_running_loop()
+        self.idle = []
+        self.counts = {"requests": 0, "opened": 0, "reused": 0, "closed": 0}
+
+    def _discard(self, writer):
+        self.counts["closed"] += 1
+        writer.close()
+
+    @staticmethod
+    def _dropped(reader, writer):
+        return (reader.at_eof() or writer.is_closing()
+                or _dropped(writer.get_extra_info("socket")))
+
+    async def _send(self, writer, method, path, body, headers):
+        head = [f"{method} {self.prefix}{path} HTTP/1.1", f"Host: {self.host_header}",
+                f"Content-Length: {len(body) if body else 0}"]
+        head += [f"{name}: {value}" for name, value in (headers or {}).items()]
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + (body or b""))
+        await writer.drain()
+
+    async def _receive(self, reader, method):
+        status_line = await reader.readline()
+        if not status_line:
+            raise http.client.RemoteDisconnected("Remote end closed connection without response")
+        version, status = status_line.decode("latin-1").split(None, 2)[:2]
+        lines = []
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            lines.append(line)
+        resp_headers = http.client.parse_headers(io.BytesIO(b"".join(lines)))
+        status = int(status)
+        keep = version == "HTTP/1.1" and resp_headers.get("Connection", "").lower() != "close"
+
+        if status in (204, 304) or method == "HEAD":
+            data = b""
+        elif resp_headers.get("Transfer-Encoding", "").lower() == "chunked":
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass  # trailers
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            data = b"".join(chunks)
+        elif resp_headers.get("Content-Length") is not None:
+            data = await reader.readexactly(int(resp_headers["Content-Length"]))
+        else:
+            data = await reader.read()
+            keep = False
+        return status, resp_headers, data, keep
+
+    async def request(self, method, path, body=None, headers=None):
+        """Send one request; returns (status, headers, body bytes)."""
+        async with self.slots:
+            self.counts["requests"] += 1
+            while True:
+                while self.idle and self._dropped(*self.idle[-1]):
+                    self._discard(self.idle.pop()[1])
+                reused = bool(self.idle)
+                if reused:
+                    self.counts["reused"] += 1
+                    reader, writer = self.idle.pop()
+                else:
+                    self.counts["opened"] += 1
+                    reader, writer = await asyncio.wait_for(
+                        asyncio.open_connection(self.host, self.port, ssl=self.ssl), self.timeout)
+                sent = False
+                try:
+                    await asyncio.wait_for(
+                        self._send(writer, method, path, body, headers), self.timeout)
+                    sent = True
+                    status, resp_headers, data, keep = await asyncio.wait_for(
+                        self._receive(reader, method), self.timeout)
+                except (ConnectionError, asyncio.IncompleteReadError) as e:
+                    self._discard(writer)
+                    if reused and (not sent or _is_idempotent(method, path)):
+                        continue  # stale keep-alive connection; retry on a fresh one
+                    raise http.client.RemoteDisconnected(str(e)) from e
+                except BaseException:
+                    self._discard(writer)  # includes cancellation mid-response
+                    raise
+                if keep and len(self.idle) < self.maxsize:
+                    self.idle.append((reader, writer))
+                else:
+                    self._discard(writer)
+                return status, resp_headers, data
+
+    def stats(self):
+        return dict(self.counts, idle=len(self.idle))
+
+    def close(self):
+        while self.idle:
+            self._discard(self.idle.pop()[1])
+
+
+ASYNC_POOL = None
+
+
+def get_async_pool():
+    """Return the AsyncConnectionPool for BASE on the running event loop."""
+    global ASYNC_POOL
+    _ensure_init()
+    loop = asyncio.get_running_loop()
+    if ASYNC_POOL is None or ASYNC_POOL.loop is not loop or ASYNC_POOL.base_url != BASE:
+        ASYNC_POOL = AsyncConnectionPool(BASE)
+    return ASYNC_POOL
+
+
+async def _timed_request_async(pool, method, path, body):
+    start = time.perf_counter()
+    sent = len(body) if body else 0
+    status, received = "error", 0
+    try:
+        status, headers, raw = await pool.request(method, path, body, HEADERS)
+        received = len(raw)
+        return status, headers, raw
+    finally:
+        METRICS.request(method, path, status, start, sent, received)
+        LIMITER.done(method, path, time.perf_counter() - start, status)
+
+
+async def api_call_async(method, path, data=None, retries=MAX_RETRIES):
+    """api_call for coroutines: same limiter, retries and metrics, no threads."""
+    pool = get_async_pool()
+    body = json.dumps(data).encode() if data else None
+    for attempt in range(retries + 1):
+        await LIMITER.acquire_async()
+        try:
+            status, headers, raw = await _timed_request_async(pool, method, path, body)
+            return _check_response(method, path, status, headers, raw)
+        except (OSError, http.client.HTTPException) as e:
+            delay = _retry_delay_for(method, path, e, attempt, retries)
+            if delay is None:
+                _give_up(e)
+                raise
+            if delay:
+                await asyncio.sleep(delay)
+                METRICS.slept("backoff", delay)
+
+
+async def clear_page_async(page_id):
+    """clear_page on the event loop: deletes run as tasks while listing continues."""
+    skipped = 0
+    pending = {}  # task -> block_id
+    start_cursor = None
+    try:
+        while True:
+            url = f"/blocks/{page_id}/children?page_size=100"
+            if start_cursor:
+                url += f"&start_cursor={start_cursor}"
+            result = await api_call_async("GET", url)
+            for block in result.get("results", []):
+                if block.get("type") in PROTECTED_TYPES:
+                    skipped += 1
+                    continue
+                task = asyncio.ensure_future(api_call_async("DELETE", f"/blocks/{block['id']}"))
+                pending[task] = block["id"]
+            if not result.get("has_more"):
+                break
+            start_cursor = result["next_cursor"]
+        await asyncio.gather(*pending, return_exceptions=True)
+    finally:
+        for task in pending:
+            task.cancel()
+    failed = [block_id for task, block_id in pending.items()
+              if task.cancelled() or task.exception() is not None]
+    print(f"  Cleared {len(pending) - len(failed)} blocks (kept {skipped} child pages)")
+    if failed:
+        print(f"  Failed to delete {len(failed)} blocks:")
+        for block_id in failed:
+            print(f"    {block_id}")
+    return failed
+
+
+async def upload_nodes_async(parent_id, nodes, depth=0, after=None, workers=None):
+    """upload_nodes on the event loop; returns the created top-level block IDs."""
+    ops = compile_plan(parent_id, nodes, after, depth)
+    return plan_ids(ops, await UploadScheduler(workers).run_async(ops))
+
+
+async def publish_nodes_async(page_id, nodes, append=False, sync=False, force=False,
+                              blue_green=False):
+    """publish_nodes on the event loop, journaled and cached the same way.
+
+    Sync and blue-green modes have no async port yet and run publish_nodes
+    on a thread.
+    """
+    if sync or blue_green:
+        return await asyncio.to_thread(publish_nodes, page_id, nodes, sync=sync, force=force,
+                                       blue_green=blue_green)
+    check_media(nodes)
+    content_hash = None if append else nodes_hash(nodes)
+    if content_hash and not force and PUBLISHED.get(page_id):
+        page = await api_call_async("GET", f"/pages/{page_id}")
+        if _is_published(page_id, content_hash, page.get("last_edited_time")):
+            return False
+    PUBLISHED.forget(page_id)
+    ops = compile_plan(page_id, nodes)
+    journal = Journal(journal_path(page_id))
+    journal.start(page_id, ops)
     if not append:
-        clear_page(page_id)
-    upload_nodes(page_id, nodes)
+        start = time.perf_counter()
+        failed = await clear_page_async(page_id)
+        METRICS.phase("clear", start, page=page_id)
+        if failed:
+            journal.close(remove=True)
+            raise RuntimeError(f"{len(failed)} old blocks could not be deleted; not uploading "
+                               f"on top of them (re-run or use --sync)")
+    journal.write({"cleared": True})
+    start = time.perf_counter()
+    try:
+        await UploadScheduler(journal=journal).run_async(ops)
+    except BaseException:
+        journal.close()
+        print(f"Upload interrupted; progress saved to {journal.path} (continue with --resume)")
+        raise
+    journal.close(remove=True)
+    METRICS.phase("upload", start, requests=len(ops))
+    if content_hash:
+        page = await api_call_async("GET", f"/pages/{page_id}")
+        PUBLISHED.put(page_id, content_hash, page.get("last_edited_time"))
+    return True
+
+
+async def upload_file_async(filepath, page_id, title, link_map=None, append=False, sync=False,
+                            force=False, blue_green=False):
+    """upload_file for asyncio services: many pages can publish on one loop.
+
+    Parsing runs on a worker thread; every request shares LIMITER and the
+    loop's connection pool. Cancelling the task stops the upload (resumable
+    with resume_upload, like an interrupted upload_file).
+    """
+    print(f"\n{'='*60}")
+    action = ("Appending" if append else "Syncing" if sync
+              else "Uploading (blue-green)" if blue_green else "Uploading")
+    print(f"{action}: {title}")
+    print(f"Source: {filepath}")
+    print(f"Page: {page_id}")
+    print(f"{'='*60}")
+
+    def parse():
+        start = time.perf_counter()
+        with open(filepath, encoding="utf-8") as f:
+            nodes = parse_markdown(f.readlines(), link_map)
+        METRICS.parsed(filepath, time.perf_counter() - start)
+        upload_media(local_media(nodes, os.path.dirname(filepath)))
+        return nodes
+
+    nodes = await asyncio.to_thread(parse)
+    print(f"Parsed: {len(nodes)} top-level blocks")
+    if not await publish_nodes_async(page_id, nodes, append=append, sync=sync, force=force,
+                                     blue_green=blue_green):
+        print("Unchanged since the last publish (use force=True to publish anyway)")
     print(f"Done: {title}")
 
 
+# ── Main ───────────────────────────────────────────────────────────
+
+def _pop_option(args, name, default=None):
+    """Remove `name value` from args and return the value (or default)."""
+    if name not in args:
+        return default
+    i = args.index(name)
+    value = args[i + 1]
+    del args[i:i + 2]
+    return value
+
+
+def _pop_flag(args, name):
+    """Remove a boolean flag from args; returns whether it was present."""
+    if name not in args:
+        return False
+    args.remove(name)
+    return True
+
+
 if __name__ == "__main__":
     args = sys.argv[1:]
 
-    append = "--append" in args
-    if append:
-        args.remove("--append")
-
-    if "--config" in args:
-        ci = args.index("--config")
-        config_path = args[ci + 1]
-        remaining = args[:ci] + args[ci + 2:]
-        _ensure_init()
-        page_id = resolve_config_path(CONFIG, config_path)
-        filepath = remaining[0]
-        title = remaining[1] if len(remaining) > 1 else "Untitled"
+    rps = float(_pop_option(args, "--rps", DEFAULT_RPS))
+    WORKERS = int(_pop_option(args, "--workers", DEFAULT_WORKERS))
+    if _pop_flag(args, "--fixed-rate"):
+        LIMITER = RateLimiter(rps)
     else:
-        filepath = args[0]
-        page_id = args[1]
-        title = args[2] if len(args) > 2 else "Untitled"
-
-    upload_file(filepath, page_id, title, append=append)
+        LIMITER = AdaptiveLimiter(rps, max_window=WORKERS)
+    DEEP_HEADINGS = _pop_option(args, "--deep-headings", DEEP_HEADINGS)
+    if DEEP_HEADINGS not in ("flatten", "nest"):
+        sys.exit("--deep-headings must be 'flatten' or 'nest'")
+
+    append = _pop_flag(args, "--append")
+    sync = _pop_flag(args, "--sync")
+    if append and sync:
+        sys.exit("--append and --sync cannot be combined")
+    stream = _pop_flag(args, "--stream")
+    if stream and sync:
+        sys.exit("--stream and --sync cannot be combined")
+    resume = _pop_flag(args, "--resume")
+    force = _pop_flag(args, "--force")
+    plan = _pop_option(args, "--plan")
+    if resume and (append or sync or stream or force or plan):
+        sys.exit("--resume cannot be combined with --append, --sync, --stream, --force or --plan")
+    if plan and (append or sync or stream):
+        sys.exit("--plan cannot be combined with --append, --sync or --stream")
+    export = _pop_flag(args, "--export")
+    importing = _pop_flag(args, "--import")
+    key = _pop_option(args, "--key")
+    if key and not importing:
+        sys.exit("--key can only be used with --import")
+    watching = _pop_flag(args, "--watch")
+    if watching and (append or stream or resume or plan or export or importing):
+        sys.exit("--watch cannot be combined with --append, --stream, --resume, --plan, --export "
+                 "or --import")
+    blue_green = _pop_flag(args, "--blue-green")
+    if blue_green and (append or sync or stream or resume or plan or watching):
+        sys.exit("--blue-green cannot be combined with --append, --sync, --stream, --resume, --plan "
+                 "or --watch")
+    profile = _pop_flag(args, "--profile")
+    trace = _pop_option(args, "--trace")
+    METRICS = Metrics(trace=bool(trace))
+
+    config_path = _pop_option(args, "--config")
+    directory = _pop_option(args, "--dir")
+    if (directory and importing) or (directory and export) or (importing and export):
+        sys.exit("--dir, --import and --export cannot be combined")
+    if (directory or importing or export) and (resume or plan or stream):
+        sys.exit("--resume, --plan and --stream cannot be combined with --dir, --import or --export")
+    if (importing or export) and (append or sync or blue_green):
+        sys.exit("--append, --sync and --blue-green cannot be combined with --import or --export")
+    markdown_out = sys.stdout
+    if export and len(args) < (1 if config_path else 2):
+        sys.stdout = sys.stderr  # stdout carries the markdown; progress, retries, --profile go to stderr
+    try:
+        if directory and watching:
+            _ensure_init()
+            mapping = map_directory(directory, resolve_config_path(CONFIG, config_path or "pages"))
+            watch([WatchedPage(os.path.join(directory, rel), page_id,
+                               LinkResolver(mapping, posixpath.dirname(rel)))
+                   for rel, page_id in sorted(mapping.items())])
+        elif directory:
+            _ensure_init()
+            publish_dir(directory, resolve_config_path(CONFIG, config_path or "pages"),
+                        append=append, sync=sync, force=force, blue_green=blue_green)
+        elif importing:
+            entry = {}
+            if config_path:
+                _ensure_init()
+                entry = resolve_config_path(CONFIG, config_path)
+                ds_id = entry["data_source_id"]
+            else:
+                ds_id = args[1]
+            import_source(args[0], ds_id, key=key or entry.get("key"), columns=entry.get("columns"))
+        elif export:
+            _ensure_init()
+            page_id = page_id_of(resolve_config_path(CONFIG, config_path)) if config_path else args.pop(0)
+            markdown = export_page(page_id)
+            if args:
+                with open(args[0], "w", encoding="utf-8") as f:
+                    f.write(markdown)
+                print(f"Exported {page_id} to {args[0]}")
+            else:
+                markdown_out.write(markdown)
+        else:
+            if config_path:
+                _ensure_init()
+                page_id = page_id_of(resolve_config_path(CONFIG, config_path))
+                filepath = args[0]
+                title = args[1] if len(args) > 1 else "Untitled"
+            else:
+                filepath = args[0]
+                page_id = args[1]
+                title = args[2] if len(args) > 2 else "Untitled"
+            if watching:
+                watch([WatchedPage(filepath, page_id)])
+            else:
+                upload_file(filepath, page_id, title, append=append, sync=sync, stream=stream,
+                            resume=resume, plan=plan, force=force, blue_green=blue_green)
+    except MediaError as e:
+        sys.exit(f"FAILED: {e}")
+    except KeyboardInterrupt:
+        if not watching:
+            raise
+    finally:
+        if profile:
+            print(METRICS.summary())
+        if trace:
+            METRICS.write(trace)
+            print(f"Trace written to {trace}")